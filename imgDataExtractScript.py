@@ -7,197 +7,2655 @@
     -------------------------
     python imgDataExtract.py --dir_path "C:/ArboLeaf_Data/Folder_Where_ScreenShots_For_Processing_Will_Be_Placed" --path_output_xls "C:/ArboLeaf_Data/Folder_Where_BodyData_ExcelFile_WillBeSaved"
 
+    # ingestion only (no plotting libraries imported, no windows opened)
+    python imgDataExtract.py ingest --dir_path "C:/ArboLeaf_Data/Folder_Where_ScreenShots_For_Processing_Will_Be_Placed" --path_output_xls "C:/ArboLeaf_Data/Folder_Where_BodyData_ExcelFile_WillBeSaved"
+
+    # correlation plots written as PNG/HTML files without opening any window
+    python imgDataExtract.py report --path_output_xls "C:/ArboLeaf_Data/Folder_Where_BodyData_ExcelFile_WillBeSaved" --headless
+
+    # throughput / accuracy benchmark on synthetic screenshots (runs offline)
+    python imgDataExtract.py benchmark --output_dir "/tmp/arboleaf_benchmark" --resolutions 1080x2316,720x1544 --noise_levels 0,12
+
     # Outputs
     ----------
     Microsoft Excel file used to store data from current and follow-up measurements.  
 """
 
-from __future__ import annotations
-import argparse
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import http
+import io
+import json
+import math
+import os
+import os.path
+import re
+import shutil
+import sqlite3
+import sys
+
+import contextlib
+import datetime
+import functools
+import glob
+import queue
+import threading
+import statistics
+import tarfile
+import tempfile
+import time
+import traceback
+import urllib.parse
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import img2pdf
+
+import numpy as np
+import pandas as pd
+
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+from pdf2image import convert_from_path
+
+# seaborn, matplotlib, mplcursors and plotly are imported inside the report
+# functions so the ingest command starts fast and runs on headless machines
+
+# ---------------------- CLI Flags -----------------------------
+
+def parse_args() -> argparse.Namespace:
+    """
+    Imports values for necessary start up variables 
+
+    Two subcommands are available: "ingest" extracts the screenshots' body stats
+    into the Excel file and "report" draws the correlation plots from it. The
+    legacy form without a subcommand runs ingest followed by an interactive report.
+    """
+    parser = argparse.ArgumentParser(description="Body health statistics extraction from Arboleaf smartphone app screenshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # arguments shared by both subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--path_output_xls", type=str, required=True, help="Dir location of the excel file where the stats read from images will be saved")
+    common.add_argument("--partitioned", action="store_true", help="dir_path holds one user/device/ subfolder tree per person; rows are keyed by User_Id and Reading_Date")
+    common.add_argument("--store", choices=["excel", "parquet", "sqlite"], default="excel", help="Measurement store; parquet/sqlite keep the data next to the Excel file, which is then produced by the export command")
+
+    # image-to-metrics pipeline options shared by ingest and benchmark
+    pipeline = argparse.ArgumentParser(add_help=False)
+    pipeline.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of processes running the image-to-metrics stage in parallel (default: number of CPU cores)")
+    pipeline.add_argument("--ocr_mode", choices=["direct", "pdf", "roi"], default="direct", help="direct: OCR the preprocessed image in memory; pdf: legacy JPEG -> PDF -> raster round trip; roi: OCR only the 13 metric value boxes of the cached layout template")
+    pipeline.add_argument("--export_pdf", action="store_true", help="In direct mode, also archive each preprocessed screenshot as a PDF next to it")
+    pipeline.add_argument("--preprocess_config", type=str, default=None, help="JSON file with the image preprocessing steps applied before OCR (default: contrast/brightness only)")
+    pipeline.add_argument("--ocr_backend", choices=["auto", "pytesseract", "tesserocr"], default="auto", help="pytesseract: one tesseract process per call; tesserocr: one engine kept loaded per worker; auto: tesserocr if installed")
+    pipeline.add_argument("--ocr_cache_dir", type=str, default=None, help="Dir of the OCR result cache (default: <Excel file name>.ocr_cache next to the Excel file)")
+    pipeline.add_argument("--ocr_cache_mb", type=int, default=512, help="Size bound of the OCR result cache; least recently used results are evicted beyond it")
+    pipeline.add_argument("--no_ocr_cache", action="store_true", help="Always run the OCR, without reading or writing the OCR result cache")
+    pipeline.add_argument("--min_confidence", type=float, default=60.0, help="Metric values tesseract reads with a lower word confidence (0-100) are re-OCR'd from their crop")
+    pipeline.add_argument("--quarantine_dir", type=str, default=None, help="Dir where screenshots whose metrics stay unreadable are moved (default: <Excel file name>.quarantine next to the Excel file)")
+    pipeline.add_argument("--dedup", action="store_true", help="Skip the copies of an already ingested screenshot (recompressed, resized or renamed) before the OCR")
+    pipeline.add_argument("--dedup_threshold", type=int, default=8, help="With --dedup, largest number of changed pixels between the downscaled pages of a screenshot and its copy")
+    pipeline.add_argument("--dead_letter_dir", type=str, default=None, help="Dir where screenshots whose processing raised an error are moved (default: <Excel file name>.dead_letter next to the Excel file)")
+
+    ingest = subparsers.add_parser("ingest", parents=[common, pipeline], help="Extract body stats from the screenshots into the Excel file")
+    ingest.add_argument("--dir_path", type=str, required=True, help="Arboleaf scrennshot images collection network location: a dir, a glob pattern or a zip/tar archive")
+    ingest.add_argument("--prefetch", type=int, default=0, help="Maximum number of screenshots read ahead of the OCR workers (default: 2 per worker)")
+    ingest.add_argument("--force", action="store_true", help="Re-scan every screenshot, even those the ingestion manifest lists as unchanged")
+    ingest.add_argument("--benchmark_ocr", action="store_true", help="Time the direct and pdf OCR paths and the OCR backends on the screenshots in dir_path instead of ingesting them")
+    ingest.add_argument("--watch", action="store_true", help="Keep running and ingest new screenshots as they land in dir_path")
+    ingest.add_argument("--settle_seconds", type=float, default=2.0, help="Watch mode: seconds a file's size and mtime must stay unchanged before it is processed")
+    ingest.add_argument("--poll_interval", type=float, default=2.0, help="Watch mode: seconds between directory scans when watchdog is not installed")
+    ingest.add_argument("--queue_size", type=int, default=64, help="Watch mode: maximum number of screenshots waiting for OCR")
+    ingest.add_argument("--flush_every", type=int, default=0, help="Write the Excel file every K new rows (0 = write once at the end of the run)")
+    ingest.add_argument("--checkpoint_seconds", type=float, default=60.0, help="Save the rows, manifest and checkpoint at least this often, so an interrupted run resumes from there (0 = only at the end)")
+    ingest.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted run instead of resuming it")
+    ingest.add_argument("--metrics_file", type=str, default=None, help="Write the per-stage timings and counters of the run to this file")
+    ingest.add_argument("--metrics_format", choices=["jsonl", "prometheus"], default="jsonl", help="jsonl: append one JSON line per stage plus a run summary; prometheus: text exposition format, rewritten each run")
+    ingest.add_argument("--profile", type=str, default=None, help="Write a cProfile dump of the ingestion to this file (profiles this process only; use --workers 1 to include the OCR stage)")
+
+    report = subparsers.add_parser("report", parents=[common], help="Plot the correlation matrices of the body stats saved in the Excel file")
+    report.add_argument("--output_dir", type=str, default=None, help="Dir where the report files are written (default: the Excel file's dir)")
+    report.add_argument("--headless", action="store_true", help="Write the plots as PNG/HTML files without opening any window")
+    report.add_argument("--corr_threshold", type=float, default=0.8, help="abs(corr coef) threshold of the filtered correlation matrix")
+    report.add_argument("--user_id", type=str, default=None, help="With --partitioned, only plot the measurements of this user")
+    report.add_argument("--window_days", type=int, default=0, help="Only correlate the readings of the last N days (default: the whole history)")
+
+    subparsers.add_parser("export", parents=[common], help="Write the measurements of a parquet/sqlite store to the Excel file")
+
+    serve = subparsers.add_parser("serve", parents=[common, pipeline], help="Run a local HTTP service ingesting the screenshots POSTed to it")
+    serve.add_argument("--host", type=str, default="127.0.0.1", help="Address the service listens on (0.0.0.0 to accept uploads from the local network)")
+    serve.add_argument("--port", type=int, default=8080, help="Port the service listens on")
+    serve.add_argument("--queue_size", type=int, default=64, help="Maximum number of uploads waiting for OCR; further uploads get 503 until it drains")
+    serve.add_argument("--upload_dir", type=str, default=None, help="Dir the uploaded screenshots are saved to (default: next to the Excel file)")
+    serve.add_argument("--max_upload_mb", type=float, default=20.0, help="Largest accepted upload, in MB")
+
+    benchmark = subparsers.add_parser("benchmark", parents=[pipeline], help="Measure throughput and extraction accuracy on synthetic screenshots with known values")
+    benchmark.add_argument("--output_dir", type=str, default=None, help="Dir where the synthetic screenshots, stores and benchmark.json are written (default: a new temp dir)")
+    benchmark.add_argument("--count", type=int, default=8, help="Number of synthetic screenshots per resolution/noise variant")
+    benchmark.add_argument("--resolutions", type=str, default="1080x2316,720x1544", help="Comma-separated WIDTHxHEIGHT screenshot sizes")
+    benchmark.add_argument("--noise_levels", type=str, default="0,12", help="Comma-separated standard deviations of the gaussian pixel noise")
+    benchmark.add_argument("--seed", type=int, default=0, help="Seed of the random metric values and noise, for reproducible runs")
+
+    argv = sys.argv[1:]
+    legacy = bool(argv) and argv[0] not in ("ingest", "report", "export", "serve", "benchmark", "-h", "--help")
+    args = parser.parse_args(["ingest"] + argv if legacy else argv)
+    args.legacy = legacy
+    return args
+
+# ---------------------- Stage Metrics -----------------------------
+
+# upper bounds (seconds) of the latency histogram buckets in the Prometheus output
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageMetrics:
+    """
+    Wall-clock timings and event counters of an ingestion run.
+
+    Every duration of a stage is kept, not just the total, so that per-image
+    latency distributions can be reported. Worker processes collect their own
+    timings and ship them back with each result, see extract_with_metrics.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.setdefault(stage, []).append(time.perf_counter() - start)
+
+    def count(self, event, n=1):
+        self.counters[event] = self.counters.get(event, 0) + n
+
+    def snapshot(self):
+        """Returns the collected (durations, counters), picklable for the trip back from a worker."""
+        return self.durations, self.counters
+
+    def merge(self, snapshot):
+        durations, counters = snapshot
+        for stage, values in durations.items():
+            self.durations.setdefault(stage, []).extend(values)
+        for event, n in counters.items():
+            self.count(event, n)
+
+    def stage_summaries(self):
+        """Returns one dict per stage: number of calls and total/mean/p50/p95/max seconds."""
+        return [{'stage': stage, **latency_summary(values)} for stage, values in sorted(self.durations.items())]
+
+    def run_summary(self, elapsed):
+        """Returns the run totals: elapsed seconds, files per second and every counter."""
+        files_per_second = self.counters.get('files_processed', 0) / elapsed if elapsed > 0 else 0.0
+        return {'elapsed_s': elapsed, 'files_per_second': files_per_second, **self.counters}
+
+    def write_json_lines(self, path, elapsed):
+        """Appends one JSON line per stage and one run summary line, all tagged with the run's timestamp."""
+        run = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(path, "a", encoding="utf-8") as f:
+            for summary in self.stage_summaries():
+                f.write(json.dumps({'run': run, 'type': 'stage', **summary}) + '\n')
+            f.write(json.dumps({'run': run, 'type': 'run', **self.run_summary(elapsed)}) + '\n')
+
+    def write_prometheus(self, path, elapsed):
+        """Writes the stage latency histograms and counters in the Prometheus text exposition format."""
+        lines = ['# HELP arboleaf_stage_seconds Wall-clock seconds spent per call of an ingestion stage',
+                 '# TYPE arboleaf_stage_seconds histogram']
+        for stage, values in sorted(self.durations.items()):
+            for bound in LATENCY_BUCKETS:
+                lines.append(f'arboleaf_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {sum(v <= bound for v in values)}')
+            lines.append(f'arboleaf_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {len(values)}')
+            lines.append(f'arboleaf_stage_seconds_sum{{stage="{stage}"}} {sum(values)}')
+            lines.append(f'arboleaf_stage_seconds_count{{stage="{stage}"}} {len(values)}')
+        lines += ['# HELP arboleaf_events_total Ingestion events (files processed, skipped, failed, OCR fallbacks)',
+                  '# TYPE arboleaf_events_total counter']
+        lines += [f'arboleaf_events_total{{event="{event}"}} {n}' for event, n in sorted(self.counters.items())]
+        lines += ['# HELP arboleaf_run_seconds Wall-clock duration of the last ingestion run',
+                  '# TYPE arboleaf_run_seconds gauge', f'arboleaf_run_seconds {elapsed}',
+                  '# HELP arboleaf_files_per_second Screenshots processed per second in the last ingestion run',
+                  '# TYPE arboleaf_files_per_second gauge',
+                  f'arboleaf_files_per_second {self.run_summary(elapsed)["files_per_second"]}']
+
+        # written atomically so a metrics scraper never reads a half-written file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def print_summary(self, elapsed):
+        """Prints the per-stage table and the run totals."""
+        for summary in self.stage_summaries():
+            print(f"{summary['stage']:>16}: {summary['count']:>6} calls, total {summary['total_s']:.2f} s, "
+                  f"mean {summary['mean_s'] * 1000:.1f} ms, p95 {summary['p95_s'] * 1000:.1f} ms, "
+                  f"max {summary['max_s'] * 1000:.1f} ms")
+        totals = self.run_summary(elapsed)
+        print(f"Run: {totals['elapsed_s']:.2f} s, {totals['files_per_second']:.2f} files/s, "
+              f"{totals.get('files_failed', 0)} failed")
+
+
+# stage metrics of this process, into which the snapshot of every extraction is merged
+_stage_metrics = StageMetrics()
+
+# the StageMetrics of the extraction running in the current thread, set by extract_with_metrics;
+# per thread, since watch and serve extract in a background thread while the writer keeps counting
+_extraction_metrics = threading.local()
+
+
+def latency_summary(values):
+    """Returns the count and total/mean/p50/p95/max (nearest-rank percentiles) of a non-empty list of seconds."""
+    ordered = sorted(values)
+    return {'count': len(ordered), 'total_s': sum(ordered), 'mean_s': sum(ordered) / len(ordered),
+            'p50_s': ordered[math.ceil(0.50 * len(ordered)) - 1],
+            'p95_s': ordered[math.ceil(0.95 * len(ordered)) - 1],
+            'max_s': ordered[-1]}
+
+
+def current_stage_metrics():
+    """Returns the StageMetrics of the extraction running in this thread, or else this process's metrics."""
+    return getattr(_extraction_metrics, 'collector', None) or _stage_metrics
+
+
+def stage_timer(stage):
+    """Times the enclosed block as a call of the given stage in the current metrics."""
+    return current_stage_metrics().timer(stage)
+
+
+def count_event(event, n=1):
+    """Increments an event counter in the current metrics."""
+    current_stage_metrics().count(event, n)
+
+
+def write_stage_metrics(args, elapsed):
+    """Prints the stage metrics of the run and writes them to args.metrics_file in args.metrics_format."""
+    _stage_metrics.print_summary(elapsed)
+    if not args.metrics_file:
+        return
+    if args.metrics_format == "prometheus":
+        _stage_metrics.write_prometheus(args.metrics_file, elapsed)
+    else:
+        _stage_metrics.write_json_lines(args.metrics_file, elapsed)
+    print(f"Stage metrics written to {args.metrics_file}")
+
+# ---------------------- Screenshot Sources -----------------------------
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# separates the archive path from the member name in the path of an archived screenshot
+ARCHIVE_MEMBER_SEPARATOR = '::'
+
+# a screenshot to ingest: its name relative to --dir_path (the key of its manifest
+# entry, e.g. 2025/IMG_0001.jpg, or backup.zip::DCIM/IMG_0001.jpg for an archived
+# screenshot), its path (archive::member for an archived
+# screenshot), its size and mtime, and for an archived screenshot a callable
+# returning its bytes (a plain file is read by the worker processing it)
+ScreenshotSource = namedtuple('ScreenshotSource', ['name', 'path', 'size', 'mtime_ns', 'read_bytes'])
+
+
+def is_glob_pattern(path):
+    """Tells whether --dir_path is a glob pattern rather than a dir or archive path."""
+    return any(c in path for c in '*?[')
+
+
+def is_archive_path(path):
+    """Compares the path's extension with the supported zip/tar archive extensions (case-insensitive)."""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def read_screenshot_bytes(jpeg_path):
+    """Reads the bytes of a screenshot file (archived screenshots come with their bytes)."""
+    with open(jpeg_path, "rb") as f:
+        return f.read()
+
+
+def glob_root(pattern):
+    """Returns the dir a glob pattern starts from (its leading components without wildcards)."""
+    root = pattern
+    while is_glob_pattern(root):
+        root = os.path.dirname(root)
+    return root or '.'
+
+
+def relative_source_name(path, root):
+    """Returns the name of a file (or archive) under root, with '/' separators."""
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def screenshot_source_for_file(jpeg_path, name=None):
+    """Returns the ScreenshotSource of a plain screenshot file, named name (default: its file name)."""
+    stat_result = os.stat(jpeg_path)
+    return ScreenshotSource(name or os.path.basename(jpeg_path), jpeg_path, stat_result.st_size, stat_result.st_mtime_ns, None)
+
+
+def iter_dir_screenshots(dir_path):
+    """Yields the screenshots of a dir (not its subdirs), sorted by name."""
+    for entry in sorted(os.scandir(dir_path), key=lambda entry: entry.name):
+        if entry.is_file() and is_jpeg_file_name(entry.name):
+            stat_result = entry.stat()
+            yield ScreenshotSource(entry.name, entry.path, stat_result.st_size, stat_result.st_mtime_ns, None)
+
+
+def iter_zip_screenshots(zip_path, name_prefix=''):
+    """
+    Yields the screenshots of a zip archive, sorted by member name and named
+    name_prefix + member name. Nothing is extracted to disk: each member is
+    only read (decompressed into memory) when its read_bytes is called.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            if not info.is_dir() and is_jpeg_file_name(info.filename):
+                mtime_ns = int(time.mktime(info.date_time + (0, 0, -1)) * 1e9)
+                yield ScreenshotSource(name_prefix + info.filename, zip_path + ARCHIVE_MEMBER_SEPARATOR + info.filename,
+                                       info.file_size, mtime_ns, functools.partial(archive.read, info))
+
+
+def iter_tar_screenshots(tar_path, name_prefix=''):
+    """
+    Yields the screenshots of a (possibly compressed) tar archive in archive
+    order, named name_prefix + member name, without extracting it to disk.
+
+    A compressed tar can only be read forward, so each member is read when it
+    is yielded; since the consumer pulls one screenshot at a time, at most the
+    screenshots it holds are in memory.
+    """
+    with tarfile.open(tar_path, mode='r:*') as archive:
+        for member in archive:
+            if member.isfile() and is_jpeg_file_name(member.name):
+                image_bytes = archive.extractfile(member).read()
+                yield ScreenshotSource(name_prefix + member.name, tar_path + ARCHIVE_MEMBER_SEPARATOR + member.name,
+                                       member.size, int(member.mtime * 1e9), lambda image_bytes=image_bytes: image_bytes)
+
+
+def iter_archive_screenshots(archive_path, name_prefix=''):
+    """Yields the screenshots of a zip or tar archive, see iter_zip_screenshots and iter_tar_screenshots."""
+    if archive_path.lower().endswith('.zip'):
+        yield from iter_zip_screenshots(archive_path, name_prefix)
+    else:
+        yield from iter_tar_screenshots(archive_path, name_prefix)
+
+
+def iter_screenshot_sources(path):
+    """
+    Lazily yields the screenshots found at --dir_path: a dir, a zip or tar
+    archive, or a glob pattern matching screenshots and/or archives.
+
+    Each screenshot is named after its path relative to --dir_path (see
+    ScreenshotSource), so same-named files of different folders or archives
+    keep apart in the manifest: a file matched by a glob by its path under the
+    glob's root dir, an archive member by archive::member, the archive being
+    named by its file name, or by its path under the glob's root dir.
+
+    Raises:
+        FileNotFoundError: When path is neither an existing dir or archive nor a glob pattern
+    """
+    if os.path.isdir(path):
+        yield from iter_dir_screenshots(path)
+    elif os.path.isfile(path) and is_archive_path(path):
+        yield from iter_archive_screenshots(path, os.path.basename(path) + ARCHIVE_MEMBER_SEPARATOR)
+    elif is_glob_pattern(path):
+        root = glob_root(path)
+        for match in sorted(glob.iglob(path, recursive=True)):
+            if os.path.isfile(match) and is_archive_path(match):
+                yield from iter_archive_screenshots(match, relative_source_name(match, root) + ARCHIVE_MEMBER_SEPARATOR)
+            elif os.path.isfile(match) and is_jpeg_file_name(match):
+                yield screenshot_source_for_file(match, relative_source_name(match, root))
+    else:
+        raise FileNotFoundError(path)
+
+
+def map_bounded(function, sources, executor=None, prefetch=1):
+    """
+    Applies function(source.path, image_bytes=...) to the screenshots of the
+    (key, ScreenshotSource) pairs of sources, on the executor when there is one.
+
+    The sources are pulled lazily and at most prefetch screenshots are in
+    flight, so the memory held by a large backfill (an archive, a glob over
+    thousands of files) stays flat instead of growing with the input. An
+    archived screenshot is read once, here, and the source yielded back holds
+    its bytes until the caller is done with it (e.g. to hash it in the manifest).
+
+    Yields:
+        tuple: (key, source, result), in the order of the sources
+    """
+    in_flight = deque()
+
+    def next_result():
+        key, source, result = in_flight.popleft()
+        return key, source, result.result() if executor else result
+
+    for key, source in sources:
+        image_bytes = None
+        if source.read_bytes:
+            with stage_timer('image_read'):
+                image_bytes = source.read_bytes()
+            source = source._replace(read_bytes=lambda image_bytes=image_bytes: image_bytes)
+        if executor:
+            in_flight.append((key, source, executor.submit(function, source.path, image_bytes=image_bytes)))
+        else:
+            in_flight.append((key, source, function(source.path, image_bytes=image_bytes)))
+        if len(in_flight) >= max(1, prefetch):
+            yield next_result()
+    while in_flight:
+        yield next_result()
+
+# ---------------------- Image Manipulation -----------------------------
+
+def image_array_2_pdf_img2pdf(image, pdf_path):
+    """
+    Archives an in-memory OpenCV image as a PDF using img2pdf, without
+    touching the source screenshot.
+
+    Args:
+        image (np.ndarray): BGR image
+        pdf_path (str): Path to save the PDF
+    """
+    try:
+        with stage_timer('pdf_write'):
+            ok, jpeg_buffer = cv2.imencode('.jpg', image)
+            if not ok:
+                raise ValueError("JPEG encoding failed")
+            with open(pdf_path, "wb") as f:
+                f.write(img2pdf.convert(jpeg_buffer.tobytes()))
+    except Exception as e:
+        print(f"Error archiving {pdf_path}: {e}")
+
+
+def jpeg_2_pdf_cv(image_path, pdf_path):
+    """
+    Converts a JPEG image to a PDF using OpenCV and Pillow.
+
+    Args:
+        image_path (str): Path to the JPEG image
+        pdf_path (str): Path to save the PDF
+    """
+    try:
+        image = cv2.imread(image_path)
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        pil_image = Image.fromarray(image_rgb)
+        pil_image.save(pdf_path)
+    except Exception as e:
+        print(f"Error converting {image_path} to PDF: {e}")
+
+
+def extract_text_from_image(image_path):
+    """Extracts text from an image using pytesseract."""
+    try:
+        img = Image.open(image_path)
+        return pytesseract.image_to_string(img)
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def extract_text_from_pdf(pdf_path):
+    """Extracts text from a PDF using pytesseract and pdf2image."""
+    with stage_timer('pdf_render'):
+        pages = convert_from_path(pdf_path)
+    text = ""
+    with stage_timer('ocr'):
+        for page in pages:
+            text += get_ocr_backend().image_to_string(page)
+    return text
+
+
+def extract_text_from_array(image):
+    """Extracts text from an in-memory OpenCV image (BGR or grayscale) using this process's OCR backend."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with stage_timer('ocr'):
+        return get_ocr_backend().image_to_string(image)
+
+
+def layout_ocr_words(words):
+    """
+    Rebuilds the text of a page from its OCR words the way tesseract's text
+    output lays it out: one line per text line, words separated by a space and
+    an empty line after each paragraph.
+
+    Args:
+        words (list[OcrWord]): Words in reading order, from a backend's image_to_data
+
+    Returns:
+        tuple: (text, [[word, conf, line, column, left, top, width, height], ...]) where
+        line/column locate each word in the text
+    """
+    lines = []
+    placed_words = []
+    previous_key = None
+    for word in words:
+        if word.line_key != previous_key:
+            if previous_key is not None:
+                if word.line_key[:2] != previous_key[:2]:
+                    lines.append('')
+            lines.append('')
+            previous_key = word.line_key
+        column = len(lines[-1]) + 1 if lines[-1] else 0
+        lines[-1] = f"{lines[-1]} {word.text}" if lines[-1] else word.text
+        placed_words.append([word.text, word.conf, len(lines) - 1, column, word.left, word.top, word.width, word.height])
+    text = '\n'.join(lines) + '\n\n' if lines else ''
+    return text, placed_words
+
+
+def extract_words_from_array(image):
+    """
+    OCRs an in-memory OpenCV image (BGR or grayscale) with this process's OCR
+    backend, keeping the confidence and position of every word.
+
+    Returns:
+        tuple: (text, words), see layout_ocr_words
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with stage_timer('ocr'):
+        words = get_ocr_backend().image_to_data(image)
+    return layout_ocr_words(words)
+
+
+def load_preprocessed_image(jpeg_path, preprocess_steps=None, image_bytes=None):
+    """
+    Decodes a screenshot from memory (its image_bytes, or the bytes of the
+    jpeg_path file) and runs it through this process's preprocessing pipeline.
+    """
+    if image_bytes is None:
+        with stage_timer('image_read'):
+            image_bytes = read_screenshot_bytes(jpeg_path)
+    with stage_timer('image_decode'):
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"cannot decode image {jpeg_path}")
+    with stage_timer('preprocess'):
+        return get_preprocessor(preprocess_steps or DEFAULT_PREPROCESS_CONFIG)(image)
+
+
+def ocr_screenshot(jpeg_path, ocr_mode="direct", export_pdf=False, preprocess_steps=None, image_bytes=None):
+    """
+    Preprocesses a screenshot in memory and returns the raw text tesseract reads
+    from it, with the confidence of each word in direct mode. The screenshot
+    file itself is never modified.
+
+    Args:
+        jpeg_path (str): Path to the screenshot JPEG
+        ocr_mode (str): "direct" passes the preprocessed array straight to
+            tesseract; "pdf" converts it to PDF and rasterizes the PDF back
+            with poppler before OCR
+        export_pdf (bool): In direct mode, also archive the preprocessed image as a PDF
+        preprocess_steps (list[dict]): Preprocessing config, see ImagePreprocessor
+        image_bytes (bytes): Content of the screenshot, read from jpeg_path if not given
+
+    Returns:
+        tuple: (text, words), see layout_ocr_words; words is None in pdf mode
+    """
+    # screenshots read from an archive get their PDF next to the archive
+    archive_path, _, member_name = jpeg_path.partition(ARCHIVE_MEMBER_SEPARATOR)
+    file_name = os.path.basename(member_name or jpeg_path)
+    full_pdf_file_path = os.path.join(os.path.dirname(archive_path), os.path.splitext(file_name)[0] + '.pdf')
+    if (ocr_mode == "pdf" or export_pdf) and os.path.abspath(full_pdf_file_path) == os.path.abspath(archive_path):
+        raise ValueError(f"the PDF of {jpeg_path} would overwrite the screenshot itself")
+
+    preprocessed_image = load_preprocessed_image(jpeg_path, preprocess_steps, image_bytes)
+
+    if ocr_mode == "pdf":
+        image_array_2_pdf_img2pdf(preprocessed_image, full_pdf_file_path)
+        return extract_text_from_pdf(full_pdf_file_path), None
+
+    if export_pdf:
+        image_array_2_pdf_img2pdf(preprocessed_image, full_pdf_file_path)
+    return extract_words_from_array(preprocessed_image)
+
+
+def benchmark_ocr_paths(jpeg_paths, preprocess_steps=None):
+    """
+    Times the direct in-memory OCR path against the JPEG -> PDF -> raster path
+    for each screenshot and prints the per-image latencies and their summary.
+
+    The pdf path is run on a temporary PDF so no archive file is left behind.
+
+    Args:
+        jpeg_paths (list[str]): Screenshots to time
+        preprocess_steps (list[dict]): Preprocessing config, see ImagePreprocessor
+    """
+    latencies = {"direct": [], "pdf": []}
+    preprocess = get_preprocessor(preprocess_steps or DEFAULT_PREPROCESS_CONFIG)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for jpeg_path in jpeg_paths:
+            start = time.perf_counter()
+            image = cv2.imread(jpeg_path)
+            extract_text_from_array(preprocess(image))
+            latencies["direct"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            image = cv2.imread(jpeg_path)
+            pdf_path = os.path.join(tmp_dir, "benchmark.pdf")
+            image_array_2_pdf_img2pdf(preprocess(image), pdf_path)
+            extract_text_from_pdf(pdf_path)
+            latencies["pdf"].append(time.perf_counter() - start)
+
+            print(f"{os.path.basename(jpeg_path)}: direct {latencies['direct'][-1] * 1000:.1f} ms, "
+                  f"pdf {latencies['pdf'][-1] * 1000:.1f} ms")
+
+    for mode, values in latencies.items():
+        if values:
+            print(f"{mode:>6}: {len(values)} images, mean {statistics.mean(values) * 1000:.1f} ms, "
+                  f"median {statistics.median(values) * 1000:.1f} ms, max {max(values) * 1000:.1f} ms")
+
+# ---------------------- Image Preprocessing Pipeline -----------------------------
+
+# Preprocessing applied before OCR when no --preprocess_config is given:
+# the historical contrast 0.5 / brightness +1 adjustment
+DEFAULT_PREPROCESS_CONFIG = [
+    {'op': 'contrast_brightness', 'contrast': 0.5, 'brightness': 1},
+]
+
+
+class ImagePreprocessor:
+    """
+    Composable in-memory preprocessing pipeline applied to a screenshot before OCR.
+
+    Each step reads the previous step's output and writes into a buffer owned by
+    the pipeline, so consecutive screenshots of the same resolution reuse the same
+    arrays instead of allocating new ones. The input image is never modified; the
+    returned array is only valid until the next call.
+
+    Steps are dicts with an 'op' key and optional parameters:
+        contrast_brightness   contrast (default 1.0), brightness (default 0)
+        grayscale
+        threshold             value (default 0), otsu (default True); needs grayscale first
+        crop                  top, bottom, left, right as fractions of the image (0-1)
+        upscale               factor (default 2.0)
+    """
+
+    STEP_OPS = ('contrast_brightness', 'grayscale', 'threshold', 'crop', 'upscale')
+
+    def __init__(self, steps):
+        for step in steps:
+            if step.get('op') not in self.STEP_OPS:
+                raise ValueError(f"Unknown preprocessing step {step.get('op')!r}, expected one of {self.STEP_OPS}")
+        self.steps = [dict(step) for step in steps]
+        self._buffers = {}
+
+    def __call__(self, image):
+        for index, step in enumerate(self.steps):
+            image = getattr(self, '_' + step['op'])(index, image, step)
+        return image
+
+    def _buffer(self, index, shape, dtype):
+        """Returns the output buffer of step `index`, reallocated only when the shape changes."""
+        buffer = self._buffers.get(index)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self._buffers[index] = buffer
+        return buffer
+
+    def _contrast_brightness(self, index, image, step):
+        # saturating alpha * image + beta, without the np.zeros operand addWeighted needs
+        dst = self._buffer(index, image.shape, np.uint8)
+        return cv2.convertScaleAbs(image, dst=dst, alpha=step.get('contrast', 1.0), beta=step.get('brightness', 0))
+
+    def _grayscale(self, index, image, step):
+        if image.ndim == 2:
+            return image
+        dst = self._buffer(index, image.shape[:2], image.dtype)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+    def _threshold(self, index, image, step):
+        if image.ndim != 2:
+            raise ValueError("the threshold step needs a grayscale image, add a grayscale step before it")
+        flags = cv2.THRESH_BINARY | (cv2.THRESH_OTSU if step.get('otsu', True) else 0)
+        dst = self._buffer(index, image.shape, image.dtype)
+        cv2.threshold(image, step.get('value', 0), 255, flags, dst=dst)
+        return dst
+
+    def _crop(self, index, image, step):
+        # slicing returns a view, so cropping costs no copy
+        height, width = image.shape[:2]
+        return image[int(step.get('top', 0.0) * height):int(step.get('bottom', 1.0) * height),
+                     int(step.get('left', 0.0) * width):int(step.get('right', 1.0) * width)]
+
+    def _upscale(self, index, image, step):
+        factor = step.get('factor', 2.0)
+        height, width = image.shape[:2]
+        dsize = (int(round(width * factor)), int(round(height * factor)))
+        dst = self._buffer(index, (dsize[1], dsize[0]) + image.shape[2:], image.dtype)
+        return cv2.resize(image, dsize, dst=dst, interpolation=cv2.INTER_CUBIC)
+
+
+# One pipeline per config and per process, so worker processes keep their buffers between screenshots
+_preprocessors = {}
+
+
+def get_preprocessor(steps):
+    """Returns this process's ImagePreprocessor for the given steps, creating it on first use."""
+    key = json.dumps(steps, sort_keys=True)
+    if key not in _preprocessors:
+        _preprocessors[key] = ImagePreprocessor(steps)
+    return _preprocessors[key]
+
+
+def load_preprocess_config(config_path):
+    """
+    Loads the preprocessing steps from a JSON file of the form {"steps": [{"op": ...}, ...]}.
+
+    Args:
+        config_path (str): Path to the JSON config, or None for DEFAULT_PREPROCESS_CONFIG
+
+    Returns:
+        list[dict]: The validated preprocessing steps
+    """
+    if config_path is None:
+        return DEFAULT_PREPROCESS_CONFIG
+    with open(config_path, "r", encoding="utf-8") as f:
+        steps = json.load(f)['steps']
+    ImagePreprocessor(steps)  # validates the op names before any worker starts
+    return steps
+
+# ---------------------- OCR Backends -----------------------------
+
+# a word recognised by tesseract: its confidence (0-100), the (block, paragraph, line)
+# numbers of its text line and its bounding box in the OCR'd image
+OcrWord = namedtuple('OcrWord', ['text', 'conf', 'line_key', 'left', 'top', 'width', 'height'])
+
+
+class PytesseractBackend:
+    """OCR backend starting a new tesseract process, which reloads its language data, on every call."""
+
+    name = "pytesseract"
+
+    def __init__(self):
+        self._engine_id = None
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_data(self, image, config=''):
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        return [OcrWord(word, float(data['conf'][k]), (data['block_num'][k], data['par_num'][k], data['line_num'][k]),
+                        data['left'][k], data['top'][k], data['width'][k], data['height'][k])
+                for k, word in enumerate(data['text']) if word.strip()]
+
+    def engine_id(self):
+        if self._engine_id is None:
+            self._engine_id = f"{self.name}/tesseract-{pytesseract.get_tesseract_version()}"
+        return self._engine_id
+
+
+class TesserocrBackend:
+    """
+    OCR backend keeping one tesseract engine loaded in-process through the
+    tesseract C API (tesserocr), so the language data is loaded only once.
+
+    Supports the '--psm N' and '-c name=value' options used in this script.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._api = tesserocr.PyTessBaseAPI()
+        self._variables = set()
+
+    def _set_image(self, image, config):
+        psm, variables = parse_tesseract_config(config)
+        self._api.SetPageSegMode(psm)
+        # the engine keeps variables between calls, so the ones the previous call set are cleared
+        for name in self._variables - variables.keys():
+            self._api.SetVariable(name, '')
+        for name, value in variables.items():
+            self._api.SetVariable(name, value)
+        self._variables = set(variables)
+
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        self._api.SetImage(image)
+
+    def image_to_string(self, image, config=''):
+        self._set_image(image, config)
+        return self._api.GetUTF8Text()
+
+    def image_to_data(self, image, config=''):
+        self._set_image(image, config)
+        self._api.Recognize()
+        level = self._tesserocr.RIL
+        words = []
+        block = par = line = 0
+        for result in self._tesserocr.iterate_level(self._api.GetIterator(), level.WORD):
+            # numbers the lines like tesseract's TSV output: paragraphs restart within a block, lines within a paragraph
+            if result.IsAtBeginningOf(level.BLOCK):
+                block, par, line = block + 1, 0, 0
+            if result.IsAtBeginningOf(level.PARA):
+                par, line = par + 1, 0
+            if result.IsAtBeginningOf(level.TEXTLINE):
+                line += 1
+            word = result.GetUTF8Text(level.WORD)
+            if word and word.strip():
+                left, top, right, bottom = result.BoundingBox(level.WORD)
+                words.append(OcrWord(word, result.Confidence(level.WORD), (block, par, line), left, top, right - left, bottom - top))
+        return words
+
+    def engine_id(self):
+        return f"{self.name}/{self._tesserocr.tesseract_version().splitlines()[0].replace(' ', '-')}"
+
+
+OCR_BACKENDS = {'pytesseract': PytesseractBackend, 'tesserocr': TesserocrBackend}
+
+# the OCR engine of this process, created once by init_ocr_backend (pool initializer)
+_ocr_backend = None
+
+
+def parse_tesseract_config(config):
+    """
+    Splits a tesseract CLI config string into its page segmentation mode and '-c' variables.
+
+    Returns:
+        tuple: (psm (int, default 3), {variable name: value})
+    """
+    psm = 3
+    variables = {}
+    options = config.split()
+    for k, option in enumerate(options[:-1]):
+        if option == '--psm':
+            psm = int(options[k + 1])
+        elif option == '-c':
+            name, _, value = options[k + 1].partition('=')
+            variables[name] = value
+    return psm, variables
+
+
+def create_ocr_backend(name):
+    """Creates an OCR backend by name; "auto" picks tesserocr when it is installed."""
+    if name == "auto":
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            return PytesseractBackend()
+    return OCR_BACKENDS[name]()
+
+
+def init_ocr_backend(name):
+    """Creates this process's OCR backend; used as the worker pool initializer."""
+    global _ocr_backend
+    _ocr_backend = create_ocr_backend(name)
+
+
+def get_ocr_backend():
+    """Returns this process's OCR backend, defaulting to pytesseract if none was initialized."""
+    global _ocr_backend
+    if _ocr_backend is None:
+        _ocr_backend = PytesseractBackend()
+    return _ocr_backend
+
+
+def benchmark_ocr_backends(jpeg_paths, preprocess_steps=None):
+    """
+    Micro-benchmark of the available OCR backends: OCRs the same preprocessed
+    screenshots with each one and prints its engine start-up time and images per second.
+
+    Args:
+        jpeg_paths (list[str]): Screenshots to OCR
+        preprocess_steps (list[dict]): Preprocessing config, see ImagePreprocessor
+    """
+    # preprocessing is done up front so only the OCR itself is timed
+    images = []
+    for jpeg_path in jpeg_paths:
+        image = load_preprocessed_image(jpeg_path, preprocess_steps)
+        images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image.copy())
+    if not images:
+        return
+
+    for name in OCR_BACKENDS:
+        start = time.perf_counter()
+        try:
+            backend = create_ocr_backend(name)
+        except ImportError as e:
+            print(f"{name:>11}: not available ({e})")
+            continue
+        startup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for image in images:
+            backend.image_to_string(image)
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:>11}: start-up {startup * 1000:.1f} ms, {len(images)} images in {elapsed:.2f} s, "
+              f"{len(images) / elapsed:.2f} images/s")
+
+# ---------------------- Image Text Extraction -----------------------------
+
+# how a metric's value is read from its token on the result page: the unit the app
+# displays, the factor applied to the number (percentages are stored as fractions)
+# and the decimals it is rounded to (None: kept as read)
+MetricSpec = namedtuple('MetricSpec', ['name', 'unit', 'scale', 'decimals'])
+
+# Body metrics in the order they appear on the ArboLeaf result page
+MEASUREMENT_SCHEMA = [
+    MetricSpec('Weight', 'lb', 1.0, 3),
+    MetricSpec('Body Fat', '%', 0.01, 3),
+    MetricSpec('BMI', '', 1.0, None),
+    MetricSpec('Skeletal Muscle', '%', 0.01, 3),
+    MetricSpec('Muscle Mass', 'lb', 1.0, 1),
+    MetricSpec('Muscle Storage Ability Level', '', 1.0, None),
+    MetricSpec('Protein', '%', 0.01, 3),
+    MetricSpec('BMR', 'kcal', 1.0, None),
+    MetricSpec('Fat-Free Body Weight', 'lb', 1.0, None),
+    MetricSpec('Subcutaneous Fat', '%', 0.01, 3),
+    MetricSpec('Visceral Fat', '', 1.0, None),
+    MetricSpec('Body Water', '%', 0.01, 3),
+    MetricSpec('Bone Mass', 'lb', 1.0, None),
+]
+
+METRIC_NAMES = [spec.name for spec in MEASUREMENT_SCHEMA]
+
+
+# a run of digits and dots; the "1b" tesseract reads for the "lb" unit is blanked out of the line first
+METRIC_TOKEN_PATTERN = re.compile(r'[0-9.]+')
+
+# a numeric token of the OCR text, with the index of its text line and its column in that line
+MetricToken = namedtuple('MetricToken', ['text', 'line', 'column'])
+
+
+def tokenize_metric_text(text, skip_lines=2):
+    """
+    Yields the numeric tokens of OCR text in a single pass over it.
+
+    Skips the leading lines, blanks out the "1b" misreads, keeps only the runs
+    of digits and dots and drops a trailing period from each of them; stray
+    dots without any digit are dropped as well.
+
+    Args:
+        text (str): Text returned by tesseract
+        skip_lines (int): Number of leading lines to ignore (the app's status bar and title)
+
+    Yields:
+        MetricToken: Each number, in reading order
+    """
+    for line_index, line in enumerate(text.splitlines()):
+        if line_index < skip_lines:
+            continue
+        # blanked with two spaces so the columns still match the OCR text
+        for match in METRIC_TOKEN_PATTERN.finditer(line.replace('1b', '  ')):
+            token = match.group()
+            if token[-1] == '.':
+                token = token[:-1]
+            if token.strip('.'):
+                yield MetricToken(token, line_index, match.start())
+
+# ---------------------- Region-of-Interest OCR -----------------------------
+
+# tesseract settings for the metric value crops: a single line of digits
+ROI_TESSERACT_CONFIG = '--psm 7 -c tessedit_char_whitelist=0123456789.'
+# all crops of a page stacked into one strip and OCR'd in a single call, one value per line
+ROI_BATCH_TESSERACT_CONFIG = '--psm 6 -c tessedit_char_whitelist=0123456789.'
+ROI_PADDING = 6      # pixels kept around each detected value box
+ROI_STRIP_GAP = 24   # blank pixels between two crops of the strip
+
+# layout templates already loaded or detected by this process, keyed by resolution
+_layout_templates = {}
+
+
+def layout_path_for(path_output_xls):
+    """Returns the path of the layout template cache kept next to the Excel output file."""
+    return os.path.splitext(path_output_xls)[0] + '.layout.json'
+
+
+def clean_numeric_token(word):
+    """Applies the text cleanup to a single OCR word and returns its number, or '' if it has none."""
+    token = next(tokenize_metric_text(word, skip_lines=0), None)
+    return token.text if token else ''
+
+
+def detect_layout_template(image):
+    """
+    Locates the value of each of the 13 body metrics with one full-page OCR pass.
+    Always uses pytesseract since it only runs once per resolution.
+
+    Mirrors the text pipeline: the first two lines are skipped and the numeric
+    words that follow are taken in reading order, so the n-th box holds the
+    value of METRIC_NAMES[n].
+
+    Args:
+        image (np.ndarray): Preprocessed screenshot
+
+    Returns:
+        list[list[int]]: [left, top, width, height] of each metric value, or None
+        if fewer than 13 numeric words were found
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with stage_timer('layout_detect'):
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+
+    # groups the recognised words by text line, keeping tesseract's reading order
+    lines = {}
+    for k, word in enumerate(data['text']):
+        if word.strip():
+            lines.setdefault((data['block_num'][k], data['par_num'][k], data['line_num'][k]), []).append(k)
+
+    boxes = []
+    for line_words in list(lines.values())[2:]:
+        for k in line_words:
+            if clean_numeric_token(data['text'][k]):
+                boxes.append([data['left'][k], data['top'][k], data['width'][k], data['height'][k]])
+
+    if len(boxes) < len(METRIC_NAMES):
+        return None
+    return boxes[:len(METRIC_NAMES)]
+
+
+def get_layout_template(image, layout_path):
+    """
+    Returns the metric value boxes for the image's resolution, detecting them
+    on first sight of that resolution and caching them in layout_path. A failed
+    detection is not cached, so it is tried again on the next screenshot.
+
+    Args:
+        image (np.ndarray): Preprocessed screenshot
+        layout_path (str): JSON file caching one template per resolution
+
+    Returns:
+        list[list[int]]: The 13 value boxes, or None if no template could be detected
+    """
+    resolution = f"{image.shape[1]}x{image.shape[0]}"
+    if resolution in _layout_templates:
+        return _layout_templates[resolution]
+
+    cached = {}
+    if layout_path and os.path.exists(layout_path):
+        with open(layout_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        _layout_templates.update(cached)
+        if resolution in cached:
+            return cached[resolution]
+
+    boxes = detect_layout_template(image)
+    if boxes is None:
+        # not cached: a later screenshot of this resolution may be clean enough to detect it
+        return None
+    _layout_templates[resolution] = boxes
+    if layout_path:
+        cached[resolution] = boxes
+        # a per-process temp name keeps concurrent workers from clobbering each other's writes
+        tmp_path = f"{layout_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cached, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, layout_path)
+    return boxes
+
+
+def crop_value_region(image, box):
+    """Returns the padded crop of a metric value box, clipped to the image."""
+    left, top, width, height = box
+    return image[max(0, top - ROI_PADDING):top + height + ROI_PADDING,
+                 max(0, left - ROI_PADDING):left + width + ROI_PADDING]
+
+
+def ocr_metric_regions(image, boxes):
+    """
+    OCRs only the metric value boxes of a screenshot in digits-only mode.
+
+    The crops are stacked into a single strip so the whole page costs one
+    tesseract call. If that call does not return exactly one line per box, each
+    crop is OCR'd on its own as a single text line instead.
+
+    Args:
+        image (np.ndarray): Preprocessed screenshot
+        boxes (list[list[int]]): Value boxes from get_layout_template
+
+    Returns:
+        list[str]: One numeric token per box ('' where nothing was read)
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    crops = [crop_value_region(image, box) for box in boxes]
+
+    strip_width = max(crop.shape[1] for crop in crops) + 2 * ROI_STRIP_GAP
+    strip_height = sum(crop.shape[0] for crop in crops) + (len(crops) + 1) * ROI_STRIP_GAP
+    strip = np.full((strip_height, strip_width), 255, dtype=image.dtype)
+    y = ROI_STRIP_GAP
+    for crop in crops:
+        strip[y:y + crop.shape[0], ROI_STRIP_GAP:ROI_STRIP_GAP + crop.shape[1]] = crop
+        y += crop.shape[0] + ROI_STRIP_GAP
+
+    ocr_backend = get_ocr_backend()
+    with stage_timer('ocr'):
+        lines = [line for line in ocr_backend.image_to_string(strip, config=ROI_BATCH_TESSERACT_CONFIG).splitlines() if line.strip()]
+    if len(lines) != len(crops):
+        count_event('roi_per_crop_retries')
+        with stage_timer('ocr'):
+            lines = [ocr_backend.image_to_string(crop, config=ROI_TESSERACT_CONFIG) for crop in crops]
+
+    return [clean_numeric_token(line) for line in lines]
+
+# ---------------------- Metric Validation -----------------------------
+
+# (low, high, integer) plausible displayed value of each metric, in the units the
+# app shows (lb or kg, %, kcal); a value outside its range was misread or shifted
+METRIC_VALID_RANGES = {
+    'Weight': (20.0, 700.0, False),
+    'Body Fat': (1.0, 75.0, False),
+    'BMI': (8.0, 90.0, False),
+    'Skeletal Muscle': (10.0, 80.0, False),
+    'Muscle Mass': (10.0, 450.0, False),
+    'Muscle Storage Ability Level': (0, 10, True),
+    'Protein': (3.0, 40.0, False),
+    'BMR': (500, 5000, True),
+    'Fat-Free Body Weight': (10.0, 600.0, False),
+    'Subcutaneous Fat': (1.0, 75.0, False),
+    'Visceral Fat': (1, 59, True),
+    'Body Water': (20.0, 85.0, False),
+    'Bone Mass': (0.5, 30.0, False),
+}
+
+# tesseract configs tried in turn on the enhanced crop of a suspect value: a single
+# text line, then a single word; the unit letters are allowed so "lb" is not read as digits
+RETRY_TESSERACT_CONFIGS = ['--psm 7 -c tessedit_char_whitelist=0123456789.%lbkca',
+                           '--psm 8 -c tessedit_char_whitelist=0123456789.%lbkca']
+
+
+class SuspectMeasurementError(ValueError):
+    """Raised when metrics of a screenshot stay missing or implausible after their re-OCR."""
+
+
+def metric_value_problem(metric, token):
+    """Returns why token is not a plausible displayed value of metric, or None if it is."""
+    if not token:
+        return "missing"
+    try:
+        value = float(token)
+    except ValueError:
+        return f"not a number: {token!r}"
+    low, high, integer = METRIC_VALID_RANGES[metric]
+    if integer and not value.is_integer():
+        return f"not an integer: {token}"
+    if not low <= value <= high:
+        return f"out of range [{low}, {high}]: {token}"
+    return None
+
+
+def metric_value_tokens(ocr_result):
+    """
+    Picks the value token of each metric from an OCR result, with the
+    confidence and box of the OCR word it was read from when they are known.
+
+    The tokens of a full-page text are only trusted when there is exactly one
+    per metric: otherwise every later metric would be shifted, so all values are
+    reported as missing and left to repair_suspect_metrics.
+
+    Returns:
+        tuple: (values, confidences, boxes) lists in METRIC_NAMES order; boxes is
+        None when the values must be located with the layout template instead
+    """
+    if ocr_result['roi']:
+        return ocr_result['text'].split('\n'), [None] * len(METRIC_NAMES), None
+
+    tokens = list(tokenize_metric_text(ocr_result['text']))
+    print("after-processing: ", [token.text for token in tokens])
+    if len(tokens) != len(METRIC_NAMES):
+        print(f"Warning: {len(tokens)} numbers found instead of {len(METRIC_NAMES)}")
+        return [''] * len(METRIC_NAMES), [None] * len(METRIC_NAMES), None
+
+    words_by_line = {}
+    for word in ocr_result['words'] or []:
+        words_by_line.setdefault(word[2], []).append(word)
+
+    confidences = []
+    boxes = []
+    for token in tokens:
+        # the word of the token's line whose columns span the token's column
+        word = next((word for word in words_by_line.get(token.line, [])
+                     if word[3] <= token.column < word[3] + len(word[0])), None)
+        confidences.append(word[1] if word else None)
+        boxes.append(word[4:8] if word else None)
+    if not ocr_result['words']:
+        boxes = None
+    return [token.text for token in tokens], confidences, boxes
+
+
+def reocr_metric_value(image, box, metric):
+    """
+    OCRs one value box again with stronger preprocessing (grayscale, 3x upscale,
+    Otsu binarization) and each of the RETRY_TESSERACT_CONFIGS page segmentation modes.
+
+    Returns:
+        str: The first plausible value read, or None
+    """
+    crop = crop_value_region(image, box)
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    crop = cv2.resize(crop, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    _, crop = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    crop = cv2.copyMakeBorder(crop, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=255)
+
+    for config in RETRY_TESSERACT_CONFIGS:
+        with stage_timer('ocr_retry'):
+            token = clean_numeric_token(get_ocr_backend().image_to_string(crop, config=config))
+        if metric_value_problem(metric, token) is None:
+            return token
+    return None
+
+
+def repair_suspect_metrics(values, confidences, boxes, jpeg_path, preprocess_steps=None, layout_path=None,
+                           min_confidence=60.0, image_bytes=None):
+    """
+    Checks the value of every metric and re-OCRs only the suspect ones: values
+    that are missing, out of their METRIC_VALID_RANGES range or read with a word
+    confidence under min_confidence. Each suspect value is re-read from its own
+    crop, so the expensive retry runs on a few small images instead of the page.
+
+    The screenshot is only decoded again when a retry is needed. Values without
+    an OCR word box (e.g. all of them when the page did not yield exactly 13
+    numbers) are located with the layout template of the resolution, detected
+    from this screenshot when none is cached yet (see get_layout_template).
+
+    Args:
+        values (list[str]): Value tokens in METRIC_NAMES order, see metric_value_tokens
+        confidences (list[float]): Word confidence of each value (None if unknown)
+        boxes (list[list[int]]): Word box of each value, or None to use the layout template
+        jpeg_path (str): Path to the screenshot JPEG
+        preprocess_steps (list[dict]): Preprocessing config, see ImagePreprocessor
+        layout_path (str): Layout template cache, see get_layout_template
+        min_confidence (float): Word confidence (0-100) under which a plausible value is re-read too
+        image_bytes (bytes): Content of the screenshot, read from jpeg_path if not given
+
+    Returns:
+        list[str]: The values, suspect ones replaced by their re-read value
+
+    Raises:
+        SuspectMeasurementError: When a missing or implausible value could not be re-read
+    """
+    values = list(values)
+    image = None
+    problems = {}
+    for k, metric in enumerate(METRIC_NAMES):
+        problem = metric_value_problem(metric, values[k])
+        low_confidence = confidences[k] is not None and confidences[k] < min_confidence
+        if problem is None and not low_confidence:
+            continue
+        count_event('suspect_fields')
+
+        if image is None:
+            image = load_preprocessed_image(jpeg_path, preprocess_steps, image_bytes)
+            if boxes is None:
+                boxes = get_layout_template(image, layout_path) or [None] * len(METRIC_NAMES)
+        retried_value = reocr_metric_value(image, boxes[k], metric) if boxes[k] is not None else None
+        if retried_value is not None:
+            count_event('suspect_fields_repaired')
+            values[k] = retried_value
+        elif problem is not None:
+            problems[metric] = problem
+
+    if len(problems) == len(METRIC_NAMES) and set(problems.values()) == {"missing"}:
+        raise SuspectMeasurementError("none of the metric values could be located on the page")
+    if problems:
+        raise SuspectMeasurementError("; ".join(f"{metric}: {problem}" for metric, problem in problems.items()))
+    return values
+
+
+def quarantine_dir_for(args):
+    """Returns the dir suspect screenshots are moved to (--quarantine_dir, or next to the Excel file)."""
+    return args.quarantine_dir or os.path.splitext(args.path_output_xls)[0] + '.quarantine'
+
+
+def dead_letter_dir_for(args):
+    """Returns the dir screenshots whose processing failed are moved to (--dead_letter_dir, or next to the Excel file)."""
+    return args.dead_letter_dir or os.path.splitext(args.path_output_xls)[0] + '.dead_letter'
+
+
+def set_aside_screenshot(args, jpeg_path, failure, user_id='', device_id='', image_bytes=None, name=None):
+    """
+    Moves a screenshot that could not be ingested out of the ingestion folder,
+    next to a JSON note of the failure, so the batch goes on without it: to the
+    quarantine dir when its metrics could not be read reliably, to the dead
+    letter dir when its processing raised an error. Once fixed (or retaken), it
+    can be put back to be ingested.
+
+    An archived screenshot (archive::member path) is copied out of the archive
+    from its image_bytes instead, the archive itself is left untouched.
+
+    Args:
+        failure (dict): 'kind' ("quarantine" or "dead_letter"), 'error' and
+            optionally 'traceback', see extract_with_metrics
+        image_bytes (bytes): Content of an archived screenshot
+        name (str): Name of the screenshot relative to --dir_path (see ScreenshotSource),
+            whose folders are kept under the set-aside dir; default: its file name
+
+    Returns:
+        dict: The failure report entry of the screenshot
+    """
+    root_dir = quarantine_dir_for(args) if failure['kind'] == "quarantine" else dead_letter_dir_for(args)
+    # '..', empty parts and drive colons are dropped, so an archive member cannot be written outside root_dir
+    name = (name or os.path.basename(jpeg_path)).replace(ARCHIVE_MEMBER_SEPARATOR, '/')
+    name_parts = [part.replace(':', '_') for part in re.split(r'[\\/]', name) if part not in ('', '.', '..')]
+    target_dir = os.path.join(root_dir, user_id, device_id, *name_parts[:-1])
+    target_path = os.path.join(target_dir, name_parts[-1])
+    entry = {'file': jpeg_path, 'moved_to': None, 'at': time.strftime('%Y-%m-%dT%H:%M:%S'), **failure}
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        if ARCHIVE_MEMBER_SEPARATOR in jpeg_path:
+            with open(target_path, "wb") as f:
+                f.write(image_bytes)
+        else:
+            shutil.move(jpeg_path, target_path)
+        entry['moved_to'] = target_path
+        with open(target_path + '.json', "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=1)
+    except OSError as e:
+        # the file stays where it is and is retried by the next run
+        print(f"Error: cannot move {jpeg_path} to {target_dir}: {e}")
+    print(f"{'Quarantined' if failure['kind'] == 'quarantine' else 'Dead-lettered'} {jpeg_path}: {failure['error']}")
+    return entry
+
+# ---------------------- Reading Timestamps -----------------------------
+
+# Reading_Date keys: to the minute when the time of the reading is known, otherwise
+# the day only (the only key of older versions, which kept one reading per day)
+READING_TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M'
+READING_DATE_FORMAT = '%Y/%m/%d'
+
+# EXIF capture time tags: DateTimeOriginal and DateTimeDigitized (in the Exif IFD), then DateTime
+EXIF_IFD = 0x8769
+EXIF_CAPTURE_TIME_TAGS = (0x9003, 0x9004)
+EXIF_DATETIME_TAG = 0x0132
+
+# top part of the page, above the Weight card: the status bar clock and the date of the reading
+READING_HEADER_FRACTION = 0.14
+
+# a date, optionally followed by a time, in a file name: 2025_04_14, 2025_04_14_08_29,
+# Screenshot_20250414-082915, Screenshot 2025-04-14 at 08.29.15
+FILE_NAME_TIMESTAMP_PATTERN = re.compile(
+    r'(?<!\d)(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})(?:(?:[-_T ]| at )(\d{2})[-_.:h]?(\d{2})(?:[-_.:]?\d{2})?)?(?!\d)')
+
+# the date under the page title (MM/DD/YYYY) and the status bar clock (H:MM)
+ON_SCREEN_DATE_PATTERN = re.compile(r'(?<!\d)(\d{1,2})/(\d{1,2})/(\d{4})(?!\d)')
+ON_SCREEN_CLOCK_PATTERN = re.compile(r'(?<![\d.])([01]?\d|2[0-3]):([0-5]\d)(?!\d)')
+
+
+def reading_timestamp_from_exif(image_bytes):
+    """Returns the EXIF capture time of a screenshot as a datetime, or None when it has none."""
+    try:
+        exif = Image.open(io.BytesIO(image_bytes)).getexif()
+    except Exception:
+        # not a readable image: the OCR stage reports it
+        return None
+    exif_ifd = exif.get_ifd(EXIF_IFD)
+    for value in [exif_ifd.get(tag) for tag in EXIF_CAPTURE_TIME_TAGS] + [exif.get(EXIF_DATETIME_TAG)]:
+        try:
+            return datetime.datetime.strptime(str(value).strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            continue
+    return None
+
+
+def reading_timestamp_from_file_name(jpeg_path):
+    """
+    Returns (datetime, has_time) for the date, and the time if any, found in the
+    file name of a screenshot (the member name for an archived one), or None.
+    """
+    file_name = os.path.basename(jpeg_path.partition(ARCHIVE_MEMBER_SEPARATOR)[2] or jpeg_path)
+    for match in FILE_NAME_TIMESTAMP_PATTERN.finditer(os.path.splitext(file_name)[0]):
+        year, month, day, hour, minute = match.groups()
+        try:
+            timestamp = datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+        except ValueError:
+            continue
+        return timestamp, hour is not None
+    return None
+
+
+def reading_timestamp_from_text(text):
+    """
+    Returns (date, (hour, minute)) as shown on the page, read from the OCR text
+    of its header (or of the whole page); either is None when it was not found.
+    """
+    reading_date = None
+    for month, day, year in ON_SCREEN_DATE_PATTERN.findall(text):
+        try:
+            reading_date = datetime.date(int(year), int(month), int(day))
+            break
+        except ValueError:
+            continue
+    clock = ON_SCREEN_CLOCK_PATTERN.search(text)
+    return reading_date, (int(clock.group(1)), int(clock.group(2))) if clock else None
+
+
+def ocr_reading_header(jpeg_path, preprocess_steps=None, image_bytes=None):
+    """OCRs only the header of a screenshot (see READING_HEADER_FRACTION) and returns its text."""
+    image = load_preprocessed_image(jpeg_path, preprocess_steps, image_bytes)
+    return extract_text_from_array(image[:max(1, int(image.shape[0] * READING_HEADER_FRACTION))])
+
+
+def resolve_reading_date(jpeg_path, image_bytes, read_header):
+    """
+    Returns the Reading_Date key of a screenshot, to the minute when the time of
+    the reading can be found, trying in turn:
+
+    1. the EXIF capture time of the image,
+    2. a date and time in its file name,
+    3. the date shown on the page with the status bar clock, from the text
+       returned by read_header().
+
+    The day of the reading is the date of a file name without a time
+    (YYYY_MM_DD.jpg), or else the date on the page, or else the date of the
+    file name's timestamp or of the EXIF capture time. A time is only
+    used when it falls on that day and on the day shown on the page (when one
+    can be read), so a screenshot taken days after the reading does not get
+    the time it was taken at; when no time passes, the key is the day only.
+
+    Raises:
+        SuspectMeasurementError: When no date can be found at all
+    """
+    with stage_timer('timestamp'):
+        from_exif = reading_timestamp_from_exif(image_bytes)
+        from_file_name = reading_timestamp_from_file_name(jpeg_path)
+
+    screen_date, clock = reading_timestamp_from_text(read_header())
+    # a date-only file name is the day the reading was named after; a timestamp only says when the screenshot was taken
+    named_date = from_file_name[0].date() if from_file_name is not None and not from_file_name[1] else None
+    taken_at = from_file_name[0] if from_file_name is not None and from_file_name[1] else from_exif
+    reading_date = named_date or screen_date or (taken_at.date() if taken_at is not None else None)
+    if reading_date is None:
+        raise SuspectMeasurementError("no reading date in the EXIF data, the file name or the page header")
+
+    timestamps = [from_exif, from_file_name[0] if from_file_name is not None and from_file_name[1] else None,
+                  datetime.datetime.combine(screen_date, datetime.time(*clock)) if screen_date and clock else None]
+    for timestamp in timestamps:
+        if timestamp is not None and timestamp.date() == reading_date and screen_date in (None, reading_date):
+            return timestamp.strftime(READING_TIMESTAMP_FORMAT)
+    return reading_date.strftime(READING_DATE_FORMAT)
+
+# ---------------------- Ingestion Manifest -----------------------------
+
+def manifest_path_for(path_output_xls, user_id='', device_id=''):
+    """
+    Returns the path of the ingestion manifest kept next to the Excel output file.
+    Each user/device partition gets its own manifest under <output>.manifests/.
+    """
+    if not user_id:
+        return os.path.splitext(path_output_xls)[0] + '.manifest.json'
+    return os.path.join(os.path.splitext(path_output_xls)[0] + '.manifests', user_id, (device_id or '_') + '.json')
+
+
+def load_manifest(manifest_path):
+    """
+    Loads the ingestion manifest recording which screenshots were already processed.
+
+    Args:
+        manifest_path (str): Path to the manifest JSON file
+
+    Returns:
+        dict: Screenshot file name -> {'sha256', 'size', 'mtime_ns', 'metrics'}.
+              Empty if the manifest does not exist or cannot be read.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f).get('files', {})
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Writes the ingestion manifest atomically (temp file + rename) so an
+    interrupted run never leaves a truncated manifest behind.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'version': 1, 'files': manifest}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_content_hash(source):
+    """Returns the SHA-256 hex digest of a ScreenshotSource's content (file or archive member)."""
+    if source.read_bytes:
+        return hashlib.sha256(source.read_bytes()).hexdigest()
+    return file_content_hash(source.path)
+
+
+def is_already_ingested(manifest, source):
+    """
+    Checks whether a screenshot (ScreenshotSource) is unchanged since it was last ingested.
+
+    The size/mtime pair is compared first so unchanged files are skipped
+    without reading them; the content hash is only computed when the stat
+    differs (e.g. the file was copied or touched), and a matching hash
+    refreshes the stored stat so the next run is a stat-only check again.
+    """
+    entry = manifest.get(source.name)
+    if entry is None:
+        return False
+
+    if entry['size'] == source.size and entry['mtime_ns'] == source.mtime_ns:
+        return True
+
+    if entry['size'] == source.size and entry['sha256'] == source_content_hash(source):
+        entry['mtime_ns'] = source.mtime_ns
+        return True
+
+    return False
+
+
+def previous_reading_date(manifest, source, measurement):
+    """
+    Returns the Reading_Date a screenshot (ScreenshotSource) was stored under
+    when it was last ingested, if it differs from the one it is read with now
+    (e.g. the day-only key of an older version), else None.
+    """
+    previous = manifest.get(source.name, {}).get('metrics', {}).get('Reading_Date')
+    return previous if previous != measurement.reading_date else None
+
+
+def record_ingested(manifest, source, metrics):
+    """Stores the hash, stat and extracted metrics of a processed screenshot (ScreenshotSource) in the manifest."""
+    manifest[source.name] = {
+        'sha256': source_content_hash(source),
+        'size': source.size,
+        'mtime_ns': source.mtime_ns,
+        'metrics': metrics,
+    }
+
+def checkpoint_path_for(path_output_xls):
+    """Returns the path of the checkpoint of an unfinished ingestion run, kept next to the Excel output file."""
+    return os.path.splitext(path_output_xls)[0] + '.checkpoint.json'
+
+
+def load_checkpoint(checkpoint_path):
+    """Returns the set of screenshot paths an interrupted run had already done, empty if there is no checkpoint."""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return set(json.load(f).get('done', []))
+
+
+def save_checkpoint(done_paths, checkpoint_path):
+    """Writes the paths of the screenshots done so far, atomically like the manifest."""
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'version': 1, 'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'done': sorted(done_paths)}, f, indent=1)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def write_failure_report(failures, path_output_xls):
+    """Writes the failure report of the run (one entry per set-aside screenshot) next to the Excel output file."""
+    report_path = os.path.splitext(path_output_xls)[0] + '.failures.json'
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({'run': time.strftime('%Y-%m-%dT%H:%M:%S'), 'failures': failures}, f, indent=1)
+    if failures:
+        print(f"{len(failures)} screenshot(s) could not be ingested, see {report_path}")
+
+# ---------------------- OCR Result Cache -----------------------------
+
+# bumped whenever the layout of the cached OCR results changes
+OCR_CACHE_FORMAT = 1
+
+
+class OcrCache:
+    """
+    Content-addressed on-disk cache of OCR results (raw text and word
+    confidences), so the parsing can be changed and the whole archive re-parsed
+    without running tesseract again.
+
+    Each result is a JSON file named after its key (see ocr_cache_key), sharded
+    by the first two hex digits of the key. Reads refresh the file's mtime, so
+    evict() can drop the least recently used results once the cache grows past
+    max_bytes. Workers only get/put; the writer process evicts.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a per-process temp name keeps concurrent workers from clobbering each other's writes
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Deletes the least recently used results until the cache is back under
+        90% of max_bytes (so eviction does not run again on the very next put).
+
+        Returns:
+            int: Number of results deleted
+        """
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith('.json'):
+                    stat = os.stat(os.path.join(root, file_name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file_name)))
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return 0
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            evicted += 1
+        return evicted
+
+
+def ocr_cache_dir_for(args):
+    """Returns the OCR cache dir of the run (--ocr_cache_dir, or next to the Excel file), or None with --no_ocr_cache."""
+    if args.no_ocr_cache:
+        return None
+    return args.ocr_cache_dir or os.path.splitext(args.path_output_xls)[0] + '.ocr_cache'
+
+
+def ocr_cache_key(image_bytes, ocr_mode, preprocess_steps):
+    """
+    Returns the cache key of a screenshot's OCR result: the hash of the image
+    content, the preprocessing steps, the OCR engine and version, and the OCR
+    mode with its tesseract configs. Any change to one of them is a cache miss.
+    """
+    configs = {'direct': [''], 'pdf': [''], 'roi': [ROI_BATCH_TESSERACT_CONFIG, ROI_TESSERACT_CONFIG]}
+    key = {'format': OCR_CACHE_FORMAT,
+           'image': hashlib.sha256(image_bytes).hexdigest(),
+           'preprocess': preprocess_steps or DEFAULT_PREPROCESS_CONFIG,
+           'engine': get_ocr_backend().engine_id(),
+           'mode': ocr_mode,
+           'configs': configs[ocr_mode]}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+# ---------------------- Duplicate Screenshot Detection -----------------------------
+
+# (width, height) of the coarse grayscale thumbnail that preselects the candidate originals of a copy
+DEDUP_SIGNATURE_SIZE = (24, 52)
+# largest coarse cell difference (gray levels) of a copy and its original; only a preselection
+DEDUP_COARSE_TOLERANCE = 32
+
+# width the page is averaged down to (keeping its aspect ratio) for the pixel-level comparison,
+# and the gray level difference above which a pixel of that image counts as changed
+DEDUP_PAGE_WIDTH = 270
+DEDUP_PIXEL_TOLERANCE = 32
+
+# a screenshot signature: the coarse thumbnail (uint8, flattened) and the DEDUP_PAGE_WIDTH page (uint8, 2-D)
+ScreenshotSignature = namedtuple('ScreenshotSignature', ['coarse', 'page'])
+
+
+def dedup_index_path_for(path_output_xls):
+    """Returns the path of the DuplicateIndex database saved next to the Excel file."""
+    return os.path.splitext(path_output_xls)[0] + '.dedup.sqlite'
+
+
+def screenshot_signature(image_bytes):
+    """
+    Returns the ScreenshotSignature of a screenshot, or None when it cannot be decoded.
+
+    The page is averaged down to DEDUP_PAGE_WIDTH pixels wide, which still
+    resolves every digit of the page: a metric changed by its last digit, a
+    new date or a new status bar clock changes dozens of its pixels by more
+    than DEDUP_PIXEL_TOLERANCE, while recompressing or resizing a screenshot
+    (down to twice DEDUP_PAGE_WIDTH) changes at most a couple. Smaller copies
+    are not recognized, so they are OCR'd like any new screenshot.
+
+    A 64-bit dHash/pHash, or a coarse thumbnail alone, cannot tell the pages
+    apart: every ArboLeaf result page has the same layout, so different
+    readings differ by only a few hash bits or gray levels.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    page_height = max(1, round(image.shape[0] * DEDUP_PAGE_WIDTH / image.shape[1]))
+    page = cv2.resize(image, (DEDUP_PAGE_WIDTH, page_height), interpolation=cv2.INTER_AREA)
+    coarse = cv2.resize(page, DEDUP_SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).ravel()
+    return ScreenshotSignature(coarse, page)
+
+
+def changed_page_pixels(page, other_page):
+    """
+    Returns the number of pixels that differ by more than DEDUP_PIXEL_TOLERANCE
+    between the pages of two signatures, or None when their aspect ratios differ.
+    """
+    if abs(page.shape[0] - other_page.shape[0]) > 1:
+        return None
+    height = min(page.shape[0], other_page.shape[0])
+    difference = np.abs(page[:height].astype(np.int16) - other_page[:height].astype(np.int16))
+    return int(np.count_nonzero(difference > DEDUP_PIXEL_TOLERANCE))
+
 
-import os
-import os.path
-import re
-import sys
+class DuplicateIndex:
+    """
+    On-disk index of the signatures (see screenshot_signature) of the ingested
+    screenshots, keyed by (user_id, device_id, file name), to skip their copies
+    before any OCR: a screenshot is a copy of an indexed one of the same user
+    when at most threshold pixels of their pages differ (see changed_page_pixels).
+
+    The coarse thumbnails are held in memory and compared all at once to find
+    the candidates; only their pages are then loaded from the SQLite database
+    and compared pixel by pixel. The signature of a screenshot on its way to the
+    OCR is only held (see hold) until it is ingested and commit() indexes it,
+    so no copy is ever linked to an original that then fails. New signatures
+    are written by save(), together with the manifests. Thread-safe, since
+    watch mode and the upload service look up and update it from two threads.
+    """
 
-import copy
+    def __init__(self, path, threshold=8):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS screenshots (user_id TEXT, device_id TEXT, file TEXT, coarse BLOB, '
+                           'page BLOB, PRIMARY KEY (user_id, device_id, file))')
+        self._signatures = {}
+        self._pending = {}
+        self._held = {}
+        for user_id, device_id, file_name, coarse in self._conn.execute('SELECT user_id, device_id, file, coarse FROM screenshots'):
+            self._signatures[(user_id, device_id, file_name)] = np.frombuffer(coarse, dtype=np.uint8)
+        self._matrices = {}
+
+    def _matrix(self, user_id):
+        # the stacked coarse thumbnails of a user, rebuilt after every change of that user's entries
+        if user_id not in self._matrices:
+            keys = [key for key in self._signatures if key[0] == user_id]
+            thumbnails = [self._signatures[key] for key in keys]
+            matrix = np.stack(thumbnails).astype(np.int16) if thumbnails else np.empty((0, 0), dtype=np.int16)
+            self._matrices[user_id] = (keys, matrix)
+        return self._matrices[user_id]
+
+    def _page(self, key):
+        if key in self._pending:
+            return self._pending[key].page
+        row = self._conn.execute('SELECT page FROM screenshots WHERE user_id = ? AND device_id = ? AND file = ?', key).fetchone()
+        return cv2.imdecode(np.frombuffer(row[0], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+    def find(self, key, signature):
+        """
+        Returns (key, changed pixels) of the indexed screenshot of the same user
+        that the screenshot of key is a copy of, or None. An entry with the same
+        key (the same file ingested again) is not a copy.
+        """
+        with self._lock:
+            keys, matrix = self._matrix(key[0])
+            if not keys:
+                return None
+            differences = np.abs(matrix - signature.coarse.astype(np.int16)).max(axis=1)
+            for k in np.argsort(differences, kind='stable'):
+                if differences[k] > DEDUP_COARSE_TOLERANCE:
+                    return None
+                if keys[k] == key:
+                    continue
+                changed_pixels = changed_page_pixels(signature.page, self._page(keys[k]))
+                if changed_pixels is not None and changed_pixels <= self.threshold:
+                    return keys[k], changed_pixels
+            return None
+
+    def add(self, key, signature):
+        with self._lock:
+            self._signatures[key] = signature.coarse
+            self._pending[key] = signature
+            self._matrices.pop(key[0], None)
+
+    def hold(self, key, signature):
+        """Keeps the signature of a screenshot until it is ingested (see commit); it is not looked up meanwhile."""
+        with self._lock:
+            self._held[key] = signature
+
+    def commit(self, key):
+        """Indexes the held signature of a screenshot once it is ingested."""
+        with self._lock:
+            signature = self._held.pop(key, None)
+        if signature is not None:
+            self.add(key, signature)
+
+    def discard(self, key):
+        """Forgets a screenshot, e.g. one that could not be ingested, so its copies are not linked to it."""
+        with self._lock:
+            self._held.pop(key, None)
+            if self._signatures.pop(key, None) is not None:
+                self._pending[key] = None
+                self._matrices.pop(key[0], None)
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO screenshots VALUES (?, ?, ?, ?, ?)',
+                                       [(*key, signature.coarse.tobytes(), cv2.imencode('.png', signature.page)[1].tobytes())
+                                        for key, signature in pending.items() if signature is not None])
+                self._conn.executemany('DELETE FROM screenshots WHERE user_id = ? AND device_id = ? AND file = ?',
+                                       [key for key, signature in pending.items() if signature is None])
+
+
+def open_dedup_index(args):
+    """Opens the run's DuplicateIndex with --dedup, otherwise returns None."""
+    if not args.dedup:
+        return None
+    return DuplicateIndex(dedup_index_path_for(args.path_output_xls), args.dedup_threshold)
+
+
+def check_duplicate(dedup_index, key, image_bytes):
+    """
+    Looks a screenshot up in the DuplicateIndex before it is OCR'd: returns the
+    report entry of the copy when it is one, otherwise holds its signature until
+    it is ingested (see DuplicateIndex.commit) and returns None.
+    """
+    with stage_timer('dedup'):
+        signature = screenshot_signature(image_bytes)
+        if signature is None:
+            # undecodable: left to the pipeline, which dead-letters it
+            return None
+        match = dedup_index.find(key, signature)
+        if match is None:
+            dedup_index.hold(key, signature)
+            return None
+    (user_id, device_id, file_name), changed_pixels = match
+    count_event('files_duplicate')
+    return {'file': key[2], 'user_id': key[0], 'device_id': key[1], 'duplicate_of': file_name,
+            'duplicate_of_device_id': device_id, 'changed_pixels': changed_pixels}
 
-import cv2
-import img2pdf
 
-import numpy as np
-import pandas as pd
+def write_duplicate_report(duplicates, path_output_xls):
+    """Writes the duplicate report of the run (one entry per skipped copy) next to the Excel output file."""
+    report_path = os.path.splitext(path_output_xls)[0] + '.duplicates.json'
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({'run': time.strftime('%Y-%m-%dT%H:%M:%S'), 'duplicates': duplicates}, f, indent=1)
+    if duplicates:
+        print(f"{len(duplicates)} screenshot(s) skipped as copies of ingested ones, see {report_path}")
 
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
+# ---------------------- Measurement Storage -----------------------------
 
-import seaborn as sns
+MEASUREMENT_COLUMNS = ['Reading_Date'] + METRIC_NAMES
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import FancyBboxPatch
-from matplotlib.colors import Normalize
-from matplotlib.cm import ScalarMappable
-import matplotlib.patheffects as path_effects
+# columns identifying whose screenshot a row comes from in partitioned ingestion
+PARTITION_COLUMNS = ['User_Id', 'Device_Id']
 
-import mplcursors
 
-import plotly.graph_objects as go
+def measurement_key_columns(args):
+    """Returns the columns a measurement is deduplicated on: Reading_Date, per user when partitioned."""
+    return ['User_Id', 'Reading_Date'] if args.partitioned else ['Reading_Date']
 
-# ---------------------- CLI Flags -----------------------------
 
-def parse_args() -> argparse.Namespace:
-    """
-    Imports values for necessary start up variables 
-    """
-    parser = argparse.ArgumentParser(description="Body health statistics extraction from Arboleaf smartphone app screenshots")
+def store_columns(key_columns):
+    """Returns all the columns of a store: the partition columns when keyed by user, then MEASUREMENT_COLUMNS."""
+    return (PARTITION_COLUMNS if 'User_Id' in key_columns else []) + MEASUREMENT_COLUMNS
 
-    # I/O and general arguments
-    parser.add_argument("--dir_path", type=str, required=True, help="Arboleaf scrennshot images collection network location")
-    parser.add_argument("--path_output_xls", type=str, required=True, help="Dir location of the excel file where the stats read from images will be saved")
+def load_existing_measurements(path_output_xls):
+    """Reads the Excel file once per run; returns an empty DataFrame if it does not exist yet."""
+    if not os.path.exists(path_output_xls):
+        return pd.DataFrame()
+    # user/device ids are kept as text even when they look like numbers
+    with stage_timer('store_read'):
+        return pd.read_excel(path_output_xls, dtype={column: str for column in PARTITION_COLUMNS})
 
-    return parser.parse_args()
 
-# ---------------------- Image Manipulation -----------------------------
+def replaceable_keys(new_df, key_columns, replaced_keys=None):
+    """
+    Returns the keys of the rows new_df replaces: its own keys, plus replaced_keys,
+    the keys its screenshots were stored under before (see previous_reading_date).
+    """
+    keys = new_df[key_columns].astype(str)
+    if replaced_keys is not None:
+        keys = pd.concat([keys, replaced_keys[key_columns].astype(str)]).drop_duplicates()
+    return keys.set_index(key_columns).index
+
 
-def sharpen_and_replace_image(image_path, brightness, contrast):
+def merge_measurements(existing_df, new_df, key_columns=('Reading_Date',), replaced_keys=None):
     """
-    Sharpens an image and adjusts brightness and contrast.
+    Merges newly extracted measurement rows into the existing measurements.
 
     Args:
-        image_path (str): Path to the image file
-        brightness (float): Value to adjust brightness
-        contrast (float): Value to adjust contrast
+        existing_df (pd.DataFrame): Measurements already saved in the Excel file
+        new_df (pd.DataFrame): Rows collected during the run, see MeasurementColumns
+        key_columns (list[str]): Columns identifying a measurement, see measurement_key_columns
+        replaced_keys (pd.DataFrame): Keys the screenshots of new_df were stored under before, see replaceable_keys
 
     Returns:
-        bool: True if successful, False otherwise
+        pd.DataFrame: Combined measurements. If a new row has the same key (Reading_Date,
+        per user when partitioned) as an existing one (or an earlier new one), the newest
+        row is kept; the rows of replaced_keys are dropped.
     """
-    try:
-        image = cv2.imread(image_path)
-        sharpened_image = cv2.addWeighted(
-            image, contrast, np.zeros(image.shape, image.dtype), 0, brightness
-        )
-        cv2.imwrite(image_path, sharpened_image)
-        return True
-    except Exception as e:
-        print(f"Error processing image {image_path}: {str(e)}")
-        return False
+    key_columns = list(key_columns)
+    new_df = new_df.drop_duplicates(subset=key_columns, keep='last')
+
+    if existing_df.empty:
+        return new_df.reset_index(drop=True)
+
+    # drops every existing row whose key is being replaced, in a single vectorized pass
+    replaced = existing_df.set_index(key_columns).index.isin(replaceable_keys(new_df, key_columns, replaced_keys))
+    existing_df = existing_df[~replaced]
+    return pd.concat([existing_df, new_df], ignore_index=True)
+
+
+def replaced_measurements(existing_df, new_df, key_columns=('Reading_Date',), replaced_keys=None):
+    """Returns the rows of existing_df that the rows of new_df replace (same key), see merge_measurements."""
+    key_columns = list(key_columns)
+    if existing_df.empty:
+        return existing_df
+    replaced = existing_df.set_index(key_columns).index.isin(replaceable_keys(new_df, key_columns, replaced_keys))
+    return existing_df[replaced]
+
+
+def typed_measurements(df):
+    """Returns the measurements with string Reading_Date/partition columns and float64 metric columns."""
+    df = df.copy()
+    df['Reading_Date'] = df['Reading_Date'].astype(str)
+    for column in PARTITION_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype(str)
+    for column in METRIC_NAMES:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64') if column in df else np.nan
+    return df
 
 
-def jpeg_2_pdf_img2pdf(image_path, pdf_path):
+class ExcelStore:
     """
-    Converts a jpeg image to PDF using img2pdf.
+    Keeps the measurements in the Excel file itself, read once and rewritten on every upsert.
 
-    Args:
-        image_path (str): Path to the JPEG image
-        pdf_path (str): Path to save the PDF
+    Like the other stores, upsert returns the previous version of the rows it
+    replaced, so the incremental statistics can take them out (see MetricStatistics).
     """
-    try:
-        img = Image.open(image_path)
-        with open(pdf_path, "wb") as f:
-            f.write(img2pdf.convert(img.filename))
-    except FileNotFoundError:
-        print(f"Error: Image file not found at {image_path}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
 
+    def __init__(self, path_output_xls, key_columns=('Reading_Date',)):
+        self.path = path_output_xls
+        self.key_columns = list(key_columns)
+        self._df = None
+
+    def _frame(self):
+        if self._df is None:
+            self._df = load_existing_measurements(self.path)
+            if not self._df.empty:
+                # Excel gives whole numbers back as ints, and older versions saved BMI as text
+                self._df = typed_measurements(self._df)
+        return self._df
+
+    def upsert(self, new_df, replaced_keys=None):
+        existing_df = self._frame()
+        merged_df = merge_measurements(existing_df, new_df, self.key_columns, replaced_keys)
+        merged_df.to_excel(self.path, index=False)
+        # kept only once written: a failed write leaves the rows to be upserted again by the next flush
+        self._df = merged_df
+        return replaced_measurements(existing_df, new_df, self.key_columns, replaced_keys)
+
+    def read(self, columns=None):
+        df = self._frame()
+        return df if columns is None else df[columns]
+
+    def export_excel(self, path_output_xls):
+        if os.path.abspath(path_output_xls) != os.path.abspath(self.path):
+            self._frame().to_excel(path_output_xls, index=False)
+
+
+class ParquetStore:
+    """
+    Columnar store: typed columns indexed by the key columns (Reading_Date, per
+    user when partitioned) in a single Parquet file.
+
+    Upserts drop the replaced keys by label on the index and rewrite the file;
+    reads of selected columns only load those columns from disk.
+    """
 
-def jpeg_2_pdf_cv(image_path, pdf_path):
+    def __init__(self, path, key_columns=('Reading_Date',)):
+        self.path = path
+        self.key_columns = list(key_columns)
+        self._df = None
+
+    def _frame(self):
+        if self._df is None:
+            if os.path.exists(self.path):
+                self._df = pd.read_parquet(self.path).set_index(self.key_columns)
+            else:
+                empty_df = pd.DataFrame(columns=store_columns(self.key_columns))
+                self._df = typed_measurements(empty_df).set_index(self.key_columns)
+        return self._df
+
+    def upsert(self, new_df, replaced_keys=None):
+        new_df = typed_measurements(new_df)
+        replaced = self._frame().index.isin(replaceable_keys(new_df, self.key_columns, replaced_keys))
+        new_df = new_df.drop_duplicates(subset=self.key_columns, keep='last').set_index(self.key_columns)
+        existing_df = self._frame()
+        replaced_df = existing_df[replaced].reset_index()
+        merged_df = pd.concat([existing_df[~replaced], new_df]).sort_index()
+
+        tmp_path = self.path + '.tmp'
+        merged_df.reset_index().to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        # kept only once written: a failed write leaves the rows to be upserted again by the next flush
+        self._df = merged_df
+        return replaced_df
+
+    def read(self, columns=None):
+        if self._df is None and os.path.exists(self.path):
+            return pd.read_parquet(self.path, columns=columns)
+        df = self._frame().reset_index()
+        return df if columns is None else df[columns]
+
+    def export_excel(self, path_output_xls):
+        self.read().to_excel(path_output_xls, index=False)
+
+
+class SqliteStore:
+    """
+    SQLite store: one REAL column per metric and the key columns (Reading_Date,
+    per user when partitioned) as the primary key, so upserts replace rows
+    through the key's index instead of scanning the table.
     """
-    Converts a JPEG image to a PDF using OpenCV and Pillow.
 
-    Args:
-        image_path (str): Path to the JPEG image
-        pdf_path (str): Path to save the PDF
+    def __init__(self, path, key_columns=('Reading_Date',)):
+        self.path = path
+        self.key_columns = list(key_columns)
+        self.columns = store_columns(self.key_columns)
+        # partitioned rows live in their own table, since their primary key differs
+        self.table = 'user_measurements' if 'User_Id' in self.key_columns else 'measurements'
+        self._conn = sqlite3.connect(path)
+        column_defs = ', '.join(f'"{column}" REAL' if column in METRIC_NAMES else f'"{column}" TEXT' for column in self.columns)
+        primary_key = ', '.join(f'"{column}"' for column in self.key_columns)
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ({column_defs}, PRIMARY KEY ({primary_key}))')
+
+    def upsert(self, new_df, replaced_keys=None):
+        df = typed_measurements(new_df)[self.columns]
+        column_list = ', '.join(f'"{column}"' for column in self.columns)
+        placeholders = ', '.join('?' for _ in self.columns)
+        # the rows about to be replaced, looked up one key at a time through the primary key's index
+        key_filter = ' AND '.join(f'"{column}" = ?' for column in self.key_columns)
+        replaced = []
+        keys = list(replaceable_keys(df, self.key_columns, replaced_keys).to_frame().itertuples(index=False, name=None))
+        for key in keys:
+            replaced.extend(self._conn.execute(f'SELECT {column_list} FROM {self.table} WHERE {key_filter}', key))
+        with self._conn:
+            # also deletes the rows the screenshots were stored under before
+            self._conn.executemany(f'DELETE FROM {self.table} WHERE {key_filter}', keys)
+            self._conn.executemany(f'INSERT OR REPLACE INTO {self.table} ({column_list}) VALUES ({placeholders})',
+                                   df.itertuples(index=False, name=None))
+        return pd.DataFrame.from_records(replaced, columns=self.columns)
+
+    def read(self, columns=None):
+        column_list = ', '.join(f'"{column}"' for column in (columns or self.columns))
+        order_by = ', '.join(f'"{column}"' for column in self.key_columns)
+        return pd.read_sql_query(f'SELECT {column_list} FROM {self.table} ORDER BY {order_by}', self._conn)
+
+    def export_excel(self, path_output_xls):
+        self.read().to_excel(path_output_xls, index=False)
+
+
+def open_store(args):
     """
+    Opens the measurement store selected by args.store; parquet/sqlite files sit next to the Excel file.
+    The store keeps its MetricStatistics up to date, see StatisticsTrackingStore.
+    """
+    key_columns = measurement_key_columns(args)
+    if args.store == "parquet":
+        store = ParquetStore(os.path.splitext(args.path_output_xls)[0] + '.parquet', key_columns)
+    elif args.store == "sqlite":
+        store = SqliteStore(os.path.splitext(args.path_output_xls)[0] + '.sqlite', key_columns)
+    else:
+        store = ExcelStore(args.path_output_xls, key_columns)
+    return StatisticsTrackingStore(store, MetricStatistics(statistics_path_for(args.path_output_xls), key_columns))
+
+# ---------------------- Incremental Statistics -----------------------------
+
+STATISTICS_FORMAT = 1
+
+# the variables tracked by MetricStatistics: the time of the reading, in days since
+# STATISTICS_EPOCH (the regressor of the trend slopes), then the body metrics
+STATISTICS_VARIABLES = ['Days'] + METRIC_NAMES
+STATISTICS_EPOCH = pd.Timestamp('2000-01-01')
+
+# readings kept in the statistics state for windowed correlations, in days before the latest reading
+STATISTICS_WINDOW_DAYS = 90
+
+# JSON key of the statistics over all the readings of the store (the other groups are user ids)
+ALL_READINGS = '*'
+
+
+def statistics_path_for(path_output_xls):
+    """Returns the path of the MetricStatistics state saved next to the Excel file."""
+    return os.path.splitext(path_output_xls)[0] + '.stats.json'
+
+
+def reading_days(reading_date):
+    """Returns a Reading_Date as days since STATISTICS_EPOCH, or None when it is not a date."""
     try:
-        image = cv2.imread(image_path)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(image_rgb)
-        pil_image.save(pdf_path)
-    except Exception as e:
-        print(f"Error converting {image_path} to PDF: {e}")
+        return (pd.Timestamp(str(reading_date)) - STATISTICS_EPOCH) / pd.Timedelta(days=1)
+    except ValueError:
+        return None
 
 
-def extract_text_from_image(image_path):
-    """Extracts text from an image using pytesseract."""
+class RunningMoments:
+    """
+    Running sums of the STATISTICS_VARIABLES over a set of readings, enough to
+    derive their means, Pearson correlations and trend slopes without the readings.
+
+    For every pair of variables (i, j), only the readings where both are known
+    count (like DataFrame.corr): n[i, j] is their number, sx[i, j] the sum of
+    variable i over them, sxx[i, j] the sum of its squares, and sxy[i, j] the
+    sum of the products of i and j. Adding or removing a reading is O(k^2).
+    """
+
+    def __init__(self, state=None):
+        size = len(STATISTICS_VARIABLES)
+        state = state or {}
+        self.n, self.sx, self.sxx, self.sxy = (np.array(state.get(name, np.zeros((size, size))), dtype='float64')
+                                               for name in ('n', 'sx', 'sxx', 'sxy'))
+
+    def add(self, vectors, sign=1):
+        """Adds (sign=1) or removes (sign=-1) readings, given as rows of STATISTICS_VARIABLES values (NaN if unknown)."""
+        vectors = np.asarray(vectors, dtype='float64').reshape(-1, len(STATISTICS_VARIABLES))
+        known = (~np.isnan(vectors)).astype('float64')
+        values = np.nan_to_num(vectors)
+        self.n += sign * (known.T @ known)
+        self.sx += sign * (values.T @ known)
+        self.sxx += sign * ((values * values).T @ known)
+        self.sxy += sign * (values.T @ values)
+
+    def to_dict(self):
+        return {'n': self.n.tolist(), 'sx': self.sx.tolist(), 'sxx': self.sxx.tolist(), 'sxy': self.sxy.tolist()}
+
+    def _covariances(self):
+        # n^2 times the covariance of (i, j) and the variances of i and of j, over the readings knowing both
+        with np.errstate(invalid='ignore'):
+            covariance = self.n * self.sxy - self.sx * self.sx.T
+            variance = self.n * self.sxx - self.sx * self.sx
+        return covariance, variance
+
+    def correlation(self):
+        """Returns the Pearson correlation matrix of the metrics (NaN where a metric does not vary)."""
+        covariance, variance = self._covariances()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = covariance / np.sqrt(variance * variance.T)
+        # rounding in the sums can leave a constant metric with a tiny variance
+        corr[(variance <= 1e-9 * np.abs(self.n * self.sxx)) | (variance.T <= 1e-9 * np.abs(self.n * self.sxx).T)] = np.nan
+        corr = np.clip(corr[1:, 1:], -1.0, 1.0)
+        return pd.DataFrame(corr, index=METRIC_NAMES, columns=METRIC_NAMES)
+
+    def trends(self):
+        """Returns the number of readings, the mean and the trend slope (per day, least squares) of each metric."""
+        covariance, variance = self._covariances()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.diag(self.sx) / np.diag(self.n)
+            slopes = covariance[0] / variance[0]
+        return pd.DataFrame({'Readings': np.diag(self.n)[1:].astype(int), 'Mean': means[1:], 'Slope_per_day': slopes[1:]},
+                            index=METRIC_NAMES)
+
+
+class MetricStatistics:
+    """
+    Incremental statistics of the measurement store, so that a report over years
+    of readings does not rescan the store: the RunningMoments of all the readings,
+    and of each user's readings in a partitioned store, persisted next to the
+    store and updated by every upsert in O(k^2) per row (a replaced row is first
+    taken out).
+
+    For windowed statistics, each group also keeps its readings of the last
+    window_days days before its latest reading; a windowed correlation sums
+    those few readings instead of reading the store.
+
+    The state records the size and mtime of the store file it matches. When
+    the store was changed without it (an older version of the script, an edit
+    in Excel, a crash between the two writes) or the state is missing, it is
+    rebuilt once from a full read of the store.
+    """
+
+    def __init__(self, path, key_columns=('Reading_Date',), window_days=STATISTICS_WINDOW_DAYS):
+        self.path = path
+        self.key_columns = list(key_columns)
+        self.window_days = window_days
+        self.groups = {}
+        self.store_stat = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: ignoring unreadable statistics {path}: {e}")
+                state = {}
+            if (state.get('format') == STATISTICS_FORMAT and state.get('key_columns') == self.key_columns
+                    and state.get('window_days', 0) >= window_days):
+                self.window_days = state['window_days']
+                self.store_stat = state['store_stat']
+                self.groups = {name: {'moments': RunningMoments(group['moments']), 'latest': group['latest'],
+                                      'window': group['window']}
+                               for name, group in state['groups'].items()}
+
+    def _group(self, name):
+        if name not in self.groups:
+            self.groups[name] = {'moments': RunningMoments(), 'latest': None, 'window': {}}
+        return self.groups[name]
+
+    def _readings(self, df):
+        # yields (group names, window key, STATISTICS_VARIABLES vector) for each row with a date
+        if df is None or len(df) == 0:
+            return
+        df = typed_measurements(pd.DataFrame(df))
+        for row in df.to_dict('records'):
+            days = reading_days(row['Reading_Date'])
+            if days is None:
+                print(f"Warning: reading '{row['Reading_Date']}' left out of the statistics, its date cannot be parsed")
+                continue
+            names = [ALL_READINGS] + ([row['User_Id']] if 'User_Id' in self.key_columns else [])
+            key = '|'.join(str(row[column]) for column in self.key_columns)
+            yield names, key, [days] + [row[metric] for metric in METRIC_NAMES]
+
+    def update(self, replaced_df, new_df):
+        """Takes the replaced rows out of the statistics and adds the new ones."""
+        for names, key, vector in self._readings(replaced_df):
+            for name in names:
+                group = self._group(name)
+                group['moments'].add(vector, sign=-1)
+                group['window'].pop(key, None)
+
+        new_df = new_df.drop_duplicates(subset=self.key_columns, keep='last')
+        for names, key, vector in self._readings(new_df):
+            for name in names:
+                group = self._group(name)
+                group['moments'].add(vector)
+                group['latest'] = vector[0] if group['latest'] is None else max(group['latest'], vector[0])
+                group['window'][key] = [None if math.isnan(value) else value for value in vector]
+
+        # readings older than the window can never come back into it, since the latest reading only moves forward
+        for group in self.groups.values():
+            if group['latest'] is not None:
+                oldest = group['latest'] - self.window_days
+                group['window'] = {key: vector for key, vector in group['window'].items() if vector[0] > oldest}
+
+    def rebuild(self, store):
+        """Recomputes the statistics from a full read of the store."""
+        print(f"Rebuilding the measurement statistics from the store ({self.path})")
+        self.groups = {}
+        self.update(None, store.read())
+        self.store_stat = store_file_stat(store)
+        self.save()
+
+    def ensure_current(self, store):
+        """Rebuilds the statistics when they do not match the store file (see the class docstring)."""
+        if self.store_stat != store_file_stat(store):
+            self.rebuild(store)
+
+    def save(self):
+        """Writes the statistics state atomically (temp file + rename)."""
+        state = {'format': STATISTICS_FORMAT, 'key_columns': self.key_columns, 'window_days': self.window_days,
+                 'store_stat': self.store_stat,
+                 'groups': {name: {'moments': group['moments'].to_dict(), 'latest': group['latest'],
+                                   'window': group['window']}
+                            for name, group in self.groups.items()}}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def moments(self, user_id=None, window_days=None):
+        """
+        Returns the RunningMoments of the readings (of user_id when given), over
+        the whole history or the last window_days days before the latest reading.
+        """
+        group = self.groups.get(ALL_READINGS if user_id is None else user_id)
+        if group is None:
+            return RunningMoments()
+        if not window_days:
+            return group['moments']
+        if window_days > self.window_days:
+            raise ValueError(f"window_days {window_days} is longer than the {self.window_days} days kept in {self.path}")
+        oldest = group['latest'] - window_days
+        moments = RunningMoments()
+        moments.add([[np.nan if value is None else value for value in vector]
+                     for vector in group['window'].values() if vector[0] > oldest])
+        return moments
+
+
+def store_file_stat(store):
+    """Returns the [size, mtime_ns] of the store's file, or None before it is first written."""
     try:
-        img = Image.open(image_path)
-        return pytesseract.image_to_string(img)
-    except Exception as e:
-        return f"Error: {e}"
+        stat_result = os.stat(store.path)
+    except OSError:
+        return None
+    return [stat_result.st_size, stat_result.st_mtime_ns]
 
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a PDF using pytesseract and pdf2image."""
-    pages = convert_from_path(pdf_path)
-    text = ""
-    for page in pages:
-        text += pytesseract.image_to_string(page)
-    return text
+class StatisticsTrackingStore:
+    """
+    Wraps a measurement store so that every upsert also updates its
+    MetricStatistics; reads and exports go straight to the store.
+    """
 
-# ---------------------- Image Text Extraction -----------------------------
+    def __init__(self, store, statistics):
+        self.store = store
+        self.statistics = statistics
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def upsert(self, new_df, replaced_keys=None):
+        # checked before the write, which changes the store file the statistics are matched against
+        self.statistics.ensure_current(self.store)
+        replaced_df = self.store.upsert(new_df, replaced_keys)
+        with stage_timer('statistics_update'):
+            self.statistics.update(replaced_df, new_df)
+            self.statistics.store_stat = store_file_stat(self.store)
+            self.statistics.save()
+        return replaced_df
+
+    def current_statistics(self, window_days=0):
+        """Returns the store's MetricStatistics, rebuilt first if stale or keeping fewer than window_days days."""
+        if window_days > self.statistics.window_days:
+            self.statistics = MetricStatistics(self.statistics.path, self.statistics.key_columns, window_days)
+        self.statistics.ensure_current(self.store)
+        return self.statistics
 
-def remove_first_two_lines(text):
-    """Removes the first two lines from the given text."""
-    lines = text.splitlines(True)
-    if len(lines) > 2:
-        return ''.join(lines[2:])
-    elif len(lines) > 0:
-        return ''
-    return text
+# ----------------- Looping through Images Ready for Processing & Text Extraction -----------------
 
+class Measurement:
+    """
+    The reading of one screenshot: its Reading_Date and the float value of each
+    metric, in MEASUREMENT_SCHEMA order. Slotted and tuple-backed, so it is
+    cheap to build in the workers and to ship back to the writer.
+    """
 
-def remove_lines_without_numbers(str_content):
-    """Removes lines without numeric characters from the text."""
-    return_str_content = ''
-    lines = str_content.splitlines()
-    for line in lines:
-        if re.search(r'\d', line):
-            return_str_content += line + "\r\n"
-    return return_str_content
+    __slots__ = ('reading_date', 'values')
 
+    def __init__(self, reading_date, values):
+        self.reading_date = reading_date
+        self.values = tuple(values)
 
-def replace_except_numbers_dots(text):
-    """Replaces all characters except numbers and dots with spaces."""
-    return re.sub(r"[^0-9\.]", " ", text)
+    def __getitem__(self, metric):
+        return self.reading_date if metric == 'Reading_Date' else self.values[METRIC_NAMES.index(metric)]
 
+    def as_dict(self):
+        """Returns Msmnt_Vars, the Reading_Date and the body metrics as a dict (for the manifest and printing)."""
+        return {'Reading_Date': self.reading_date, **dict(zip(METRIC_NAMES, self.values))}
 
-def replace_multiple_spaces(text):
-    """Replaces multiple spaces with a single space."""
-    return re.sub(r"\s+", " ", text)
 
+class MeasurementColumns:
+    """
+    Accumulates Measurement rows (with their user/device ids when partitioned)
+    into preallocated NumPy float64 columns, doubled when full, so that a batch
+    becomes a single DataFrame with numeric metric columns only when it is
+    written to the store.
+    """
 
-def replace_bad_characters(text):
-    """Replaces bad characters with spaces.
+    def __init__(self, partitioned=False, capacity=256):
+        self.partitioned = partitioned
+        self.columns = np.empty((len(MEASUREMENT_SCHEMA), capacity), dtype='float64')
+        self.reading_dates = []
+        self.user_ids = []
+        self.device_ids = []
+        # (user_id, device_id, Reading_Date) of the rows the appended screenshots were stored under before
+        self.replaced = []
+
+    def __len__(self):
+        return len(self.reading_dates)
+
+    def append(self, measurement, user_id='', device_id='', replaces=None):
+        size = len(self.reading_dates)
+        if size == self.columns.shape[1]:
+            grown = np.empty((self.columns.shape[0], 2 * size), dtype='float64')
+            grown[:, :size] = self.columns
+            self.columns = grown
+        self.columns[:, size] = measurement.values
+        self.reading_dates.append(measurement.reading_date)
+        if self.partitioned:
+            self.user_ids.append(user_id)
+            self.device_ids.append(device_id)
+        if replaces is not None:
+            self.replaced.append((user_id, device_id, replaces))
+
+    def clear(self):
+        self.reading_dates.clear()
+        self.user_ids.clear()
+        self.device_ids.clear()
+        self.replaced.clear()
+
+    def replaced_keys(self):
+        """Returns the keys the accumulated screenshots were stored under before, see previous_reading_date."""
+        replaced_df = pd.DataFrame(self.replaced, columns=PARTITION_COLUMNS + ['Reading_Date'])
+        return replaced_df if self.partitioned else replaced_df[['Reading_Date']]
+
+    def to_frame(self):
+        """Returns the accumulated rows as a DataFrame with the store's columns (see store_columns)."""
+        size = len(self.reading_dates)
+        data = {'User_Id': self.user_ids, 'Device_Id': self.device_ids} if self.partitioned else {}
+        data['Reading_Date'] = self.reading_dates
+        for k, metric in enumerate(METRIC_NAMES):
+            data[metric] = self.columns[k, :size].copy()
+        return pd.DataFrame(data)
+
+
+def build_measurement(extracted_text, reading_date):
+    """
+    Maps the numeric tokens of a result page, in page order, to the 13 body
+    metrics, scaled and rounded as declared in MEASUREMENT_SCHEMA.
 
     Args:
-        text: The input string.
+        extracted_text (list[str]): Numeric tokens, one per metric in METRIC_NAMES order
+        reading_date (str): Date of the measurement
 
     Returns:
-        The string without the bad chars, or the original string if no bad chars waere found.
+        Measurement: The Reading_Date and the body metrics
     """
+    values = []
+    for spec, token in zip(MEASUREMENT_SCHEMA, extracted_text):
+        value = float(token[:-1] if token.endswith('.') else token) * spec.scale
+        values.append(value if spec.decimals is None else round(value, spec.decimals))
+    measurement = Measurement(reading_date, values)
+
+    print(measurement.as_dict())
+
+    return measurement
 
-    bad_chars = ['1b']
-    for c in bad_chars:
-        text = re.sub(c, " ", text)
-    return text
 
-def remove_trailing_period(input_string):
+def ocr_jpeg(jpeg_path, ocr_mode="direct", export_pdf=False, preprocess_steps=None, layout_path=None, image_bytes=None):
     """
-    Removes the trailing period from a string, if present.
+    Runs the OCR stage for a single ArboLeaf screenshot.
+
+    Returns:
+        dict: The OCR result, as cached by OcrCache: 'text' (the raw OCR text,
+        or in roi mode one value token per line), 'words' (see layout_ocr_words,
+        None when the path has no word confidences) and 'roi' (True when 'text'
+        holds the roi mode's value tokens)
+    """
+    if ocr_mode == "roi":
+        preprocessed_image = load_preprocessed_image(jpeg_path, preprocess_steps, image_bytes)
+        boxes = get_layout_template(preprocessed_image, layout_path)
+        if boxes is not None:
+            tokens = ocr_metric_regions(preprocessed_image, boxes)
+            return {'text': '\n'.join(tokens), 'words': None, 'roi': True}
+        # no usable template for this resolution: fall back to a full-page OCR
+        count_event('roi_fallbacks')
+        text, words = extract_words_from_array(preprocessed_image)
+        return {'text': text, 'words': words, 'roi': False}
+
+    text, words = ocr_screenshot(jpeg_path, ocr_mode, export_pdf, preprocess_steps, image_bytes)
+    return {'text': text, 'words': words, 'roi': False}
+
+
+def extract_metrics_from_jpeg(jpeg_path, ocr_mode="direct", export_pdf=False, preprocess_steps=None, layout_path=None,
+                              ocr_cache_dir=None, ocr_cache_mb=0, min_confidence=60.0, image_bytes=None):
+    """
+    Runs the image-to-metrics stage for a single ArboLeaf screenshot: preprocesses
+    and OCRs the image (or reuses its cached OCR result), then parses the 13 body
+    metrics, re-reading the suspect ones (see repair_suspect_metrics).
+
+    Kept at module level so it can be shipped to the worker processes.
+
+    The screenshot is read once: the same bytes are hashed for the cache key
+    and decoded in memory (cv2.imdecode) by the OCR and retry stages.
+
+    The Reading_Date comes from resolve_reading_date. Its page header text is
+    the full-page OCR text; the roi mode, which only reads the value boxes,
+    OCRs the small header region instead and caches its text with the result.
 
     Args:
-        input_string: The string to process.
+        jpeg_path (str): Path to the screenshot JPEG (archive::member for an archived screenshot)
+        ocr_mode (str): "direct" or "pdf", see ocr_screenshot, or "roi" to OCR
+            only the metric value boxes of the cached layout template
+        export_pdf (bool): Archive the preprocessed screenshot as a PDF in direct mode
+            (the cache is then bypassed, since a cache hit would skip the archiving)
+        preprocess_steps (list[dict]): Preprocessing config, see ImagePreprocessor
+        layout_path (str): Layout template cache used by the roi mode
+        ocr_cache_dir (str): OcrCache dir, or None to always run the OCR
+        ocr_cache_mb (int): Size bound of the OcrCache
+        min_confidence (float): Word confidence under which a value is re-read
+        image_bytes (bytes): Content of the screenshot, read from jpeg_path if not
+            given (archived screenshots are always given with their content)
 
     Returns:
-        The string with the trailing period removed, or the original string if no period was found.
+        Measurement: The Reading_Date and the body metrics read from the image
+
+    Raises:
+        SuspectMeasurementError: When some metrics stay missing or implausible, or
+            the screenshot has no reading date
     """
-    if input_string and input_string[-1] == '.':
-        return input_string[:-1]
-    return input_string
+    if image_bytes is None:
+        with stage_timer('image_read'):
+            image_bytes = read_screenshot_bytes(jpeg_path)
+
+    ocr_cache = OcrCache(ocr_cache_dir, ocr_cache_mb * 1024 * 1024) if ocr_cache_dir and not export_pdf else None
+    ocr_result = None
+    if ocr_cache:
+        with stage_timer('ocr_cache_lookup'):
+            cache_key = ocr_cache_key(image_bytes, ocr_mode, preprocess_steps)
+            ocr_result = ocr_cache.get(cache_key)
+        count_event('ocr_cache_hits' if ocr_result is not None else 'ocr_cache_misses')
+
+    if ocr_result is None:
+        ocr_result = ocr_jpeg(jpeg_path, ocr_mode, export_pdf, preprocess_steps, layout_path, image_bytes)
+        if ocr_cache:
+            ocr_cache.put(cache_key, ocr_result)
+
+    def read_header():
+        if not ocr_result['roi']:
+            return ocr_result['text']
+        if 'header' not in ocr_result:
+            ocr_result['header'] = ocr_reading_header(jpeg_path, preprocess_steps, image_bytes)
+            if ocr_cache:
+                ocr_cache.put(cache_key, ocr_result)
+        return ocr_result['header']
+
+    reading_date = resolve_reading_date(jpeg_path, image_bytes, read_header)
+    with stage_timer('parse'):
+        values, confidences, boxes = metric_value_tokens(ocr_result)
+    values = repair_suspect_metrics(values, confidences, boxes, jpeg_path, preprocess_steps, layout_path, min_confidence,
+                                    image_bytes)
+    with stage_timer('parse'):
+        return build_measurement(values, reading_date)
+
+
+def is_jpeg_file_name(file_name):
+    """Compares the file extension with the screenshot extensions (case-insensitive)."""
+    return os.path.splitext(file_name)[1].lower() in ('.jpg', '.jpeg')
+
+
+def extract_with_metrics(extract, jpeg_path, image_bytes=None):
+    """
+    Runs extract on one screenshot with a fresh StageMetrics (for the current
+    thread only) and returns (Measurement, metrics snapshot, problem), so the
+    stage timings taken in a worker process or thread reach the writer, which
+    merges them.
+
+    This is the per-file error boundary: a screenshot that cannot be ingested
+    gives (None, snapshot, failure) instead of raising, so the writer can set
+    it aside (see set_aside_screenshot) and go on. The failure only holds
+    strings, since not every exception survives the trip back from a worker.
+    """
+    metrics = StageMetrics()
+    outer_metrics = getattr(_extraction_metrics, 'collector', None)
+    _extraction_metrics.collector = metrics
+    try:
+        try:
+            with stage_timer('image_total'):
+                measurement = extract(jpeg_path, image_bytes=image_bytes)
+        except SuspectMeasurementError as e:
+            return None, metrics.snapshot(), {'kind': "quarantine", 'error': str(e)}
+        except Exception as e:
+            return None, metrics.snapshot(), {'kind': "dead_letter", 'error': f"{type(e).__name__}: {e}",
+                                              'traceback': traceback.format_exc()}
+        return measurement, metrics.snapshot(), None
+    finally:
+        _extraction_metrics.collector = outer_metrics
+
+
+def evict_ocr_cache(args):
+    """Trims the run's OCR result cache back under --ocr_cache_mb, if the cache is enabled."""
+    ocr_cache_dir = ocr_cache_dir_for(args)
+    if ocr_cache_dir and os.path.isdir(ocr_cache_dir):
+        with stage_timer('ocr_cache_evict'):
+            count_event('ocr_cache_evictions', OcrCache(ocr_cache_dir, args.ocr_cache_mb * 1024 * 1024).evict())
+
+
+def build_extract_function(args):
+    """
+    Returns extract_metrics_from_jpeg bound to the ingest options and wrapped by
+    extract_with_metrics, picklable for the worker pool.
+    """
+    extract = functools.partial(extract_metrics_from_jpeg, ocr_mode=args.ocr_mode, export_pdf=args.export_pdf,
+                                preprocess_steps=load_preprocess_config(args.preprocess_config),
+                                layout_path=layout_path_for(args.path_output_xls),
+                                ocr_cache_dir=ocr_cache_dir_for(args), ocr_cache_mb=args.ocr_cache_mb,
+                                min_confidence=args.min_confidence)
+    return functools.partial(extract_with_metrics, extract)
+
+
+def create_ocr_executor(args, workers):
+    """
+    Creates the worker pool of the image-to-metrics stage, or returns None and
+    initializes the OCR backend in-process when a single worker is enough
+    (the pool is only worth its start-up cost with more than one worker).
+    """
+    if workers > 1:
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_backend, initargs=(args.ocr_backend,))
+    init_ocr_backend(args.ocr_backend)
+    return None
+
+
+def list_partitions(args):
+    """
+    Returns the (user_id, device_id, dir_path) screenshot folders to ingest.
+
+    Without args.partitioned that is dir_path itself, with empty ids. Otherwise
+    every dir_path/<user>/<device>/ folder is a partition, and screenshots put
+    directly in dir_path/<user>/ form the user's partition with an empty device id.
+    """
+    if not args.partitioned:
+        return [('', '', args.dir_path)]
+
+    partitions = []
+    for user_dir in sorted(os.scandir(args.dir_path), key=lambda entry: entry.name):
+        if not user_dir.is_dir():
+            continue
+        partitions.append((user_dir.name, '', user_dir.path))
+        for device_dir in sorted(os.scandir(user_dir.path), key=lambda entry: entry.name):
+            if device_dir.is_dir():
+                partitions.append((user_dir.name, device_dir.name, device_dir.path))
+    return partitions
 
-# ----------------- Looping through Images Ready for Processing & Text Extraction -----------------
 
 def process_jpg_files(args):
     """
@@ -205,6 +2663,35 @@ def process_jpg_files(args):
     extracts the body stats from the image and updates the MS Excel file where 
     all results are saved.
 
+    Screenshots already recorded in the ingestion manifest with an unchanged
+    size/mtime (or content hash) are skipped unless args.force is set.
+
+    The measurement store (the Excel file by default) is read once; new rows are
+    collected in memory and upserted at the end of the run, or every
+    args.flush_every rows if that is set.
+
+    dir_path can also be a zip/tar archive or a glob pattern (see
+    iter_screenshot_sources). The screenshots are streamed: they are listed
+    lazily and at most args.prefetch of them are read ahead of the OCR workers
+    (see map_bounded), archived ones straight from the archive into memory.
+
+    The image-to-metrics stage runs on a pool of args.workers processes while
+    this process stays the single writer, merging results in input order.
+
+    A screenshot that cannot be ingested is set aside (quarantine or dead letter
+    dir) and listed in the run's failure report; the batch goes on. Progress is
+    checkpointed every args.checkpoint_seconds, so a run that is interrupted
+    (Ctrl+C, crash, power loss) resumes where it stopped, even with --force.
+
+    Copies of an ingested screenshot (recompressed, resized or renamed) are
+    spotted before the OCR (see DuplicateIndex), linked to it in the manifest
+    and listed in the run's duplicate report, when args.dedup is set.
+
+    With args.partitioned, the screenshots of every user/device partition (see
+    list_partitions) share the same worker pool; each partition keeps its own
+    manifest and its rows are tagged with User_Id and Device_Id, so readings of
+    different users on the same date never replace each other.
+
     Args:
         dir_path (str): The directory path to browse
 
@@ -213,247 +2700,843 @@ def process_jpg_files(args):
         include all body statistics. 
     """
 
-    try:
-        for jpeg_file in os.scandir(args.dir_path):
-            if jpeg_file.is_file():
-                # Splits the filename into root and extension
-                root, ext = os.path.splitext(jpeg_file.name)
-
-                # Compares the extracted extension with the target extension (case-insensitive)
-                if ext.lower() == '.jpg' or  ext.lower() == '.jpeg':
-
-                    full_pdf_file_path = args.dir_path + '/' + jpeg_file.name.replace('jpg', 'pdf').replace('jpeg', 'pdf')
-                    reading_date = jpeg_file.name.replace('_', '/').replace('.jpg', '').replace('.jpeg', '')
-
-                    # Process image
-                    sharpen_and_replace_image(jpeg_file, 1, 0.5)
-                    jpeg_2_pdf_img2pdf(jpeg_file, full_pdf_file_path)
-
-                    # Extract and clean text
-                    extracted_text = extract_text_from_pdf(full_pdf_file_path)
-                    extracted_text = remove_first_two_lines(extracted_text)
-                    print("pre-processed: ", extracted_text)
-
-                    extracted_text = remove_lines_without_numbers(extracted_text)
-                    extracted_text = replace_bad_characters(extracted_text)
-                    extracted_text = replace_except_numbers_dots(extracted_text)
-                    extracted_text = replace_multiple_spaces(extracted_text)
-                    extracted_text = extracted_text.split()
-                    extracted_text = [remove_trailing_period(item) for item in extracted_text]
-                    print("after-processing: ", extracted_text)
-
-                    # Initialize dictionary with metrics
-                    Msmnt_Vars = {
-                        'Reading_Date': reading_date
-                    }
-
-                    if extracted_text[0][-1] == '.':
-                        extracted_text[0] = extracted_text[0][:-1]
-
-                    Msmnt_Vars['Weight'] = float("{:.3f}".format(float(extracted_text[0])))
-                    Msmnt_Vars['Body Fat'] = float("{:.3f}".format(float(extracted_text[1]) / 100.0))
-                    Msmnt_Vars['BMI'] = extracted_text[2]
-                    Msmnt_Vars['Skeletal Muscle'] = float("{:.3f}".format(float(extracted_text[3]) / 100.0))
-                    Msmnt_Vars['Muscle Mass'] = float("{:.1f}".format(float(extracted_text[4])))
-                    Msmnt_Vars['Muscle Storage Ability Level'] = float(extracted_text[5])
-                    Msmnt_Vars['Protein'] = float("{:.3f}".format(float(extracted_text[6]) / 100.0))
-                    Msmnt_Vars['BMR'] = float(extracted_text[7])
-                    Msmnt_Vars['Fat-Free Body Weight'] = float(extracted_text[8])
-                    Msmnt_Vars['Subcutaneous Fat'] = float("{:.3f}".format(float(extracted_text[9]) / 100.0))
-                    Msmnt_Vars['Visceral Fat'] = float(extracted_text[10])
-                    Msmnt_Vars['Body Water'] = float("{:.3f}".format(float(extracted_text[11]) / 100.0))
-                    Msmnt_Vars['Bone Mass'] = float(extracted_text[12])
-
-                    print(Msmnt_Vars)
-
-                    # Export to Excel
-                    df = pd.DataFrame(data=Msmnt_Vars, index=[0])
-
-                    if not os.path.exists(args.path_output_xls):
-                        df.to_excel(args.path_output_xls, index=False)
-                    else:
-                        existing_df = pd.read_excel(args.path_output_xls)
-
-                        # if the new record has the same date with an existing 
-                        # then it drops the latter and keeps the former
-                        existing_df = existing_df.drop(existing_df[existing_df['Reading_Date'] == reading_date].index)
+    # one manifest per partition, keyed by (user_id, device_id)
+    manifests = {}
+    dirty_partitions = set()
+    processed_count = 0
+    skipped_count = 0
+    failures = []
+    duplicates = []
+    dedup_index = open_dedup_index(args)
+
+    checkpoint_path = checkpoint_path_for(args.path_output_xls)
+    done_paths = set() if args.restart else load_checkpoint(checkpoint_path)
+    if done_paths:
+        print(f"Resuming an interrupted run: {len(done_paths)} screenshot(s) already done")
+    pending_done_paths = []
+    last_flush = time.monotonic()
+    completed = False
+
+    store = open_store(args)
+    pending_rows = MeasurementColumns(args.partitioned)
+
+    def flush_pending_rows():
+        nonlocal last_flush
+        last_flush = time.monotonic()
+        if pending_rows:
+            try:
+                with stage_timer('store_write'):
+                    store.upsert(pending_rows.to_frame(), pending_rows.replaced_keys())
+            except Exception as e:
+                # e.g. a workbook locked by Excel: the rows are kept and written by the next flush
+                print(f"Error: cannot write the measurement store, {len(pending_rows)} row(s) kept for the next flush: {e}")
+                return
+            pending_rows.clear()
+        # the manifests are saved after the store so both stay consistent after a crash
+        if dirty_partitions:
+            with stage_timer('manifest_write'):
+                for partition in dirty_partitions:
+                    manifest_path, manifest = manifests[partition]
+                    save_manifest(manifest, manifest_path)
+                if dedup_index:
+                    dedup_index.save()
+            dirty_partitions.clear()
+        if pending_done_paths:
+            done_paths.update(pending_done_paths)
+            pending_done_paths.clear()
+            save_checkpoint(done_paths, checkpoint_path)
+
+    def pending_sources():
+        nonlocal skipped_count
+        for user_id, device_id, partition_dir in list_partitions(args):
+            manifest_path = manifest_path_for(args.path_output_xls, user_id, device_id)
+            # loaded even with --force, which only re-scans: the entries are kept until they are replaced,
+            # so a resumed --force run still saves those of the screenshots done before the interruption
+            manifest = load_manifest(manifest_path)
+            manifests[(user_id, device_id)] = (manifest_path, manifest)
+
+            sources = iter_dir_screenshots(partition_dir) if args.partitioned else iter_screenshot_sources(partition_dir)
+            for source in sources:
+                with stage_timer('manifest_check'):
+                    already_ingested = (source.path in done_paths
+                                        or (not args.force and is_already_ingested(manifest, source)))
+                if already_ingested:
+                    skipped_count += 1
+                    continue
+
+                if dedup_index:
+                    # read once here: the bytes go on to the OCR worker with the source
+                    image_bytes = source.read_bytes() if source.read_bytes else read_screenshot_bytes(source.path)
+                    source = source._replace(read_bytes=lambda image_bytes=image_bytes: image_bytes)
+                    duplicate = check_duplicate(dedup_index, (user_id, device_id, source.name), image_bytes)
+                    if duplicate is not None:
+                        duplicates.append(duplicate)
+                        record_ingested(manifest, source, {'duplicate_of': duplicate['duplicate_of']})
+                        dirty_partitions.add((user_id, device_id))
+                        pending_done_paths.append(source.path)
+                        continue
+                yield (user_id, device_id), source
 
-                        new_df = pd.DataFrame(data=Msmnt_Vars, index=[0])
-                        
-                        combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-                        combined_df.to_excel(args.path_output_xls, index=False)
+    try:
+        workers = max(1, args.workers)
+        executor = create_ocr_executor(args, workers)
+        try:
+            # results come back in submission order, so rows are merged in input order
+            extract = build_extract_function(args)
+            results = map_bounded(extract, pending_sources(), executor, args.prefetch or 2 * workers)
+
+            for (user_id, device_id), source, (measurement, worker_metrics, failure) in results:
+                _stage_metrics.merge(worker_metrics)
+                pending_done_paths.append(source.path)
+                if failure is not None:
+                    if dedup_index:
+                        dedup_index.discard((user_id, device_id, source.name))
+                    image_bytes = source.read_bytes() if source.read_bytes else None
+                    failures.append(set_aside_screenshot(args, source.path, failure, user_id, device_id, image_bytes,
+                                                         source.name))
+                    continue
+
+                if dedup_index:
+                    dedup_index.commit((user_id, device_id, source.name))
+
+                # Queue the row for the Excel export
+                manifest = manifests[(user_id, device_id)][1]
+                pending_rows.append(measurement, user_id, device_id, previous_reading_date(manifest, source, measurement))
+
+                record_ingested(manifest, source, measurement.as_dict())
+                dirty_partitions.add((user_id, device_id))
+                processed_count += 1
+
+                if ((args.flush_every > 0 and len(pending_rows) >= args.flush_every)
+                        or (args.checkpoint_seconds > 0 and time.monotonic() - last_flush >= args.checkpoint_seconds)):
+                    flush_pending_rows()
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+        completed = True
     except FileNotFoundError:
         print(f"Error: dir not found at '{args.dir_path}'")
+    except KeyboardInterrupt:
+        print("Interrupted: progress is checkpointed, run the same command again to resume")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        print(f"An error occurred, run the same command again to resume: {e}")
+    finally:
+        flush_pending_rows()
+        if completed and not pending_rows:
+            # the run is complete: the next one starts from the manifest alone
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+        write_failure_report(failures, args.path_output_xls)
+        write_duplicate_report(duplicates, args.path_output_xls)
+        evict_ocr_cache(args)
+        quarantined_count = sum(failure['kind'] == "quarantine" for failure in failures)
+        count_event('files_processed', processed_count)
+        count_event('files_skipped', skipped_count)
+        count_event('files_quarantined', quarantined_count)
+        count_event('files_failed', len(failures) - quarantined_count)
+        print(f"Screenshots processed: {processed_count}, skipped (already ingested): {skipped_count}, "
+              f"duplicates: {len(duplicates)}, quarantined: {quarantined_count}, failed: {len(failures) - quarantined_count}")
+
+# ----------------- Watch Mode: Ingesting Screenshots as They Land -----------------
+
+class ScreenshotWatcher:
+    """
+    Tracks the JPEGs created or modified in a directory and reports each one
+    once it has stopped changing, so partially written files are never OCR'd.
 
-# Tesseract executable path
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+    Uses watchdog's native file notifications (inotify, FSEvents, ...) when it is
+    installed, and falls back to scanning the directory every poll_interval seconds.
+    """
 
-# ------------------------------- MAIN ----------------------------------------------------------
+    def __init__(self, dir_path, settle_seconds, poll_interval):
+        self.dir_path = dir_path
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self._candidates = {}   # path -> ((size, mtime_ns), monotonic time that stat was first seen) or None
+        self._reported = {}     # path -> (size, mtime_ns) when it was last reported ready
+        self._lock = threading.Lock()
+        self._observer = None
+        self._last_scan = 0.0
+
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print(f"watchdog is not installed, polling {self.dir_path} every {self.poll_interval}s")
+        else:
+            watcher = self
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if not event.is_directory:
+                        watcher.touch(getattr(event, 'dest_path', '') or event.src_path)
+
+            self._observer = Observer()
+            self._observer.schedule(Handler(), self.dir_path, recursive=False)
+            self._observer.start()
+
+        # screenshots already in the folder are candidates too
+        self.scan()
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def touch(self, path):
+        """Marks a file as possibly new or modified."""
+        if is_jpeg_file_name(path):
+            with self._lock:
+                self._candidates.setdefault(path, None)
+
+    def scan(self):
+        self._last_scan = time.monotonic()
+        for entry in os.scandir(self.dir_path):
+            if entry.is_file() and is_jpeg_file_name(entry.name):
+                self.touch(entry.path)
+
+    def ready_paths(self):
+        """Returns the candidates whose size and mtime did not change for settle_seconds."""
+        if self._observer is None and time.monotonic() - self._last_scan >= self.poll_interval:
+            self.scan()
+
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, seen in list(self._candidates.items()):
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    del self._candidates[path]
+                    continue
+
+                signature = (stat_result.st_size, stat_result.st_mtime_ns)
+                if self._reported.get(path) == signature:
+                    # unchanged since it was last handed over (e.g. re-listed by the polling scan)
+                    del self._candidates[path]
+                elif seen is None or seen[0] != signature:
+                    self._candidates[path] = (signature, now)
+                elif now - seen[1] >= self.settle_seconds and stat_result.st_size > 0:
+                    del self._candidates[path]
+                    self._reported[path] = signature
+                    ready.append(path)
+        return sorted(ready)
+
+
+# seconds between two attempts to write the rows the store refused, when no new rows arrive
+WATCH_RETRY_SECONDS = 5
+
+
+def watch_jpg_files(args):
+    """
+    Long-running ingestion of the screenshots landing in dir_path.
 
-def main():
+    The main thread debounces the watcher's files into a bounded work queue
+    (blocking when it is full, so a burst of new files cannot pile up unbounded
+    work); a writer thread feeds the queue to the image-to-metrics stage, at most
+    args.workers files in flight, and upserts each finished row into the store
+    right away. Rows the store cannot take (e.g. a workbook left open in Excel)
+    are kept and written again with the next rows, or after WATCH_RETRY_SECONDS.
+
+    With args.dedup, copies of an ingested screenshot are skipped before they
+    are queued (see DuplicateIndex). Stops on Ctrl+C.
     """
-    Main function  
+    manifest_path = manifest_path_for(args.path_output_xls)
+    manifest = load_manifest(manifest_path)
+    dedup_index = open_dedup_index(args)
+    store = open_store(args)
+    extract = build_extract_function(args)
+    workers = max(1, args.workers)
+    executor = create_ocr_executor(args, workers)
+    work_queue = queue.Queue(maxsize=max(1, args.queue_size))
+
+    def write_results():
+        in_flight = deque()
+        stopping = False
+        last_eviction = time.monotonic()
+        pending_rows = MeasurementColumns()
+        last_write_attempt = 0.0
+        while not stopping or in_flight:
+            if not stopping and len(in_flight) < workers:
+                try:
+                    jpeg_path = work_queue.get(timeout=0.2)
+                except queue.Empty:
+                    jpeg_path = ''
+                if jpeg_path is None:
+                    stopping = True
+                elif jpeg_path:
+                    if executor:
+                        in_flight.append((jpeg_path, executor.submit(extract, jpeg_path)))
+                    else:
+                        in_flight.append((jpeg_path, None))
+
+            # collects the finished files in arrival order and writes them in one upsert
+            rows_before = len(pending_rows)
+            while in_flight and (in_flight[0][1] is None or in_flight[0][1].done() or stopping or len(in_flight) >= workers):
+                jpeg_path, future = in_flight.popleft()
+                try:
+                    measurement, worker_metrics, failure = future.result() if future else extract(jpeg_path)
+                except Exception as e:
+                    count_event('files_failed')
+                    if dedup_index:
+                        dedup_index.discard(('', '', os.path.basename(jpeg_path)))
+                    print(f"Error processing {jpeg_path}: {e}")
+                    continue
+                _stage_metrics.merge(worker_metrics)
+                if failure is not None:
+                    count_event('files_quarantined' if failure['kind'] == "quarantine" else 'files_failed')
+                    if dedup_index:
+                        dedup_index.discard(('', '', os.path.basename(jpeg_path)))
+                    set_aside_screenshot(args, jpeg_path, failure)
+                    continue
+                count_event('files_processed')
+                if dedup_index:
+                    dedup_index.commit(('', '', os.path.basename(jpeg_path)))
+                source = screenshot_source_for_file(jpeg_path)
+                pending_rows.append(measurement, replaces=previous_reading_date(manifest, source, measurement))
+                record_ingested(manifest, source, measurement.as_dict())
+            new_rows = len(pending_rows) > rows_before
+            if pending_rows and (new_rows or stopping or time.monotonic() - last_write_attempt > WATCH_RETRY_SECONDS):
+                last_write_attempt = time.monotonic()
+                try:
+                    with stage_timer('store_write'):
+                        store.upsert(pending_rows.to_frame(), pending_rows.replaced_keys())
+                    # the manifest is saved after the store so both stay consistent after a crash
+                    with stage_timer('manifest_write'):
+                        save_manifest(manifest, manifest_path)
+                        if dedup_index:
+                            dedup_index.save()
+                except Exception as e:
+                    # e.g. a workbook locked by Excel: the rows are kept and written again later
+                    print(f"Error: cannot write the measurement store or manifest, {len(pending_rows)} row(s) kept for the next write: {e}")
+                    continue
+                print(f"Ingested {len(pending_rows)} screenshot(s), {work_queue.qsize()} waiting")
+                pending_rows.clear()
+                # a long-running watch trims the OCR cache every 10 minutes, not only when it stops
+                if time.monotonic() - last_eviction > 600:
+                    evict_ocr_cache(args)
+                    last_eviction = time.monotonic()
+        if pending_rows:
+            # not in the saved manifest either, so their screenshots are ingested again at the next start
+            print(f"Error: {len(pending_rows)} row(s) could not be written before stopping")
+
+    writer = threading.Thread(target=write_results, name="screenshot-writer")
+    writer.start()
+
+    watcher = ScreenshotWatcher(args.dir_path, args.settle_seconds, args.poll_interval)
+    watcher.start()
+    print(f"Watching {args.dir_path} for new screenshots (Ctrl+C to stop)")
+    try:
+        while writer.is_alive():
+            for jpeg_path in watcher.ready_paths():
+                if not args.force and is_already_ingested(manifest, screenshot_source_for_file(jpeg_path)):
+                    continue
+                if dedup_index:
+                    duplicate = check_duplicate(dedup_index, ('', '', os.path.basename(jpeg_path)),
+                                                read_screenshot_bytes(jpeg_path))
+                    if duplicate is not None:
+                        print(f"Skipping {jpeg_path}: a copy of {duplicate['duplicate_of']}")
+                        continue
+                # blocks while the queue is full, but gives up if the writer thread died
+                while writer.is_alive():
+                    try:
+                        work_queue.put(jpeg_path, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("Stopping watch mode")
+    finally:
+        watcher.stop()
+        if writer.is_alive():
+            work_queue.put(None)
+        writer.join()
+        if executor:
+            executor.shutdown()
+        evict_ocr_cache(args)
+
+# ----------------- Upload Service: Ingesting Screenshots POSTed over HTTP -----------------
+
+# latencies kept for the status endpoint, the most recent ones only
+SERVICE_LATENCY_WINDOW = 1000
+
+# a screenshot accepted by the service: its (user_id, device_id) partition, its
+# saved file, its content and the time.monotonic() it was received at
+UploadedScreenshot = namedtuple('UploadedScreenshot', ['partition', 'source', 'image_bytes', 'received_at'])
+
+
+def upload_dir_for(args):
+    """Returns the dir the service saves uploads to (--upload_dir, or next to the Excel file)."""
+    return args.upload_dir or os.path.splitext(args.path_output_xls)[0] + '.uploads'
+
+
+def is_safe_path_part(name):
+    """Tells whether a file/user/device name sent by a client can be used as a single path component."""
+    return bool(name) and name not in ('.', '..') and os.path.basename(name) == name and '\\' not in name
+
+
+def http_response(status, payload, headers=()):
+    """Encodes an HTTP/1.1 response with a JSON body; the connection is closed after it."""
+    body = json.dumps(payload).encode('utf-8')
+    head = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}", "Content-Type: application/json",
+            f"Content-Length: {len(body)}", "Connection: close", *headers]
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+
+class UploadService:
+    """
+    Local HTTP service ingesting the screenshots phones POST to it, built on
+    asyncio's streams so it needs no web framework:
+
+        POST /upload?name=2025_04_14.jpg  (body: the JPEG; add &user_id=...&device_id=... with --partitioned)
+        GET /status                      (queue depth, counters and latencies, as JSON)
+
+    Each upload is saved to the upload dir, then queued in a bounded queue; when
+    the queue is full the service answers 503 with a Retry-After header instead
+    of buffering more, so clients back off while the OCR catches up. args.workers
+    tasks take the queued screenshots to the image-to-metrics stage, which runs
+    in the worker pool (see create_ocr_executor) so the CPU-bound OCR never
+    blocks the event loop. A single writer task upserts the finished rows in
+    batches, off the event loop, and records them in the manifests.
+
+    Screenshots still in the upload dir when the service starts (the service was
+    stopped before ingesting them) are queued again, and an upload identical to
+    an ingested screenshot, or with args.dedup a copy of one (see DuplicateIndex),
+    is answered as a duplicate without being saved or OCR'd.
     """
 
-    args = parse_args()
+    def __init__(self, args):
+        self.args = args
+        self.upload_dir = upload_dir_for(args)
+        self.store = open_store(args)
+        self.extract = build_extract_function(args)
+        self.workers = max(1, args.workers)
+        self.max_upload_bytes = int(args.max_upload_mb * 1024 * 1024)
+        # one manifest per partition, keyed by (user_id, device_id)
+        self.manifests = {}
+        self.dedup_index = open_dedup_index(args)
+        self.pending_rows = MeasurementColumns(args.partitioned)
+        self.counters = {'uploads_accepted': 0, 'uploads_rejected': 0, 'uploads_duplicate': 0,
+                         'files_processed': 0, 'files_quarantined': 0, 'files_failed': 0}
+        self.latencies = {stage: deque(maxlen=SERVICE_LATENCY_WINDOW) for stage in ('queue_wait', 'processing', 'total')}
+        self.in_flight = 0
+        self.started_at = time.monotonic()
+        self.executor = None
+        self.work_queue = None
+        self.results = None
+
+    def manifest(self, partition):
+        if partition not in self.manifests:
+            manifest_path = manifest_path_for(self.args.path_output_xls, *partition)
+            self.manifests[partition] = (manifest_path, load_manifest(manifest_path))
+        return self.manifests[partition][1]
+
+    def status(self):
+        """Returns the service's queue depth, in-flight count, counters and recent latency summaries."""
+        return {'queue_depth': self.work_queue.qsize(), 'queue_capacity': self.work_queue.maxsize,
+                'in_flight': self.in_flight, 'pending_rows': len(self.pending_rows),
+                'uptime_s': time.monotonic() - self.started_at, **self.counters,
+                'latency': {stage: latency_summary(values) for stage, values in self.latencies.items() if values}}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            method, target = (lines[0].split(' ') + [''])[:2]
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            url = urllib.parse.urlsplit(target)
+            query = dict(urllib.parse.parse_qsl(url.query))
+
+            if url.path == '/status' and method == 'GET':
+                response = http_response(200, self.status())
+            elif url.path == '/upload' and method in ('POST', 'PUT'):
+                response = await self.handle_upload(reader, headers, query)
+            elif url.path in ('/status', '/upload'):
+                response = http_response(405, {'error': f"{method} not allowed on {url.path}"})
+            else:
+                response = http_response(404, {'error': f"no such endpoint {url.path}"})
+            writer.write(response)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the client went away, possibly in the middle of an upload's body: nothing to answer
+            pass
+        finally:
+            writer.close()
+
+    async def handle_upload(self, reader, headers, query):
+        name = query.get('name') or headers.get('x-file-name', '')
+        if not is_safe_path_part(name) or not is_jpeg_file_name(name):
+            return http_response(400, {'error': "name must be the screenshot's .jpg/.jpeg file name"})
+        partition = ('', '')
+        if self.args.partitioned:
+            partition = (query.get('user_id', ''), query.get('device_id', ''))
+            if not is_safe_path_part(partition[0]) or (partition[1] and not is_safe_path_part(partition[1])):
+                return http_response(400, {'error': "--partitioned: user_id (and optionally device_id) are required"})
+        if 'content-length' not in headers:
+            return http_response(411, {'error': "Content-Length is required"})
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            return http_response(400, {'error': "Content-Length must be a non-negative integer"})
+        if length > self.max_upload_bytes:
+            return http_response(413, {'error': f"uploads are limited to {self.args.max_upload_mb} MB"})
+        # the backpressure: a full queue is refused before the body is even read
+        if self.work_queue.full():
+            self.counters['uploads_rejected'] += 1
+            return http_response(503, {'error': "queue full, retry later", 'queue_depth': self.work_queue.qsize()},
+                                 headers=["Retry-After: 1"])
+
+        image_bytes = await reader.readexactly(length)
+        received_at = time.monotonic()
+        target_dir = os.path.join(self.upload_dir, *partition)
+        target_path = os.path.join(target_dir, name)
+        source = ScreenshotSource(name, target_path, len(image_bytes), 0, lambda: image_bytes)
+        entry = self.manifest(partition).get(name)
+        if entry is not None and entry['sha256'] == source_content_hash(source):
+            self.counters['uploads_duplicate'] += 1
+            return http_response(200, {'status': "duplicate", 'file': name})
+        if self.dedup_index:
+            duplicate = await asyncio.to_thread(check_duplicate, self.dedup_index, (*partition, name), image_bytes)
+            if duplicate is not None:
+                self.counters['uploads_duplicate'] += 1
+                return http_response(200, {'status': "duplicate", 'file': name, 'duplicate_of': duplicate['duplicate_of'],
+                                           'changed_pixels': duplicate['changed_pixels']})
+
+        os.makedirs(target_dir, exist_ok=True)
+        tmp_path = target_path + '.part'
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, target_path)
+        try:
+            self.work_queue.put_nowait(UploadedScreenshot(partition, screenshot_source_for_file(target_path),
+                                                          image_bytes, received_at))
+        except asyncio.QueueFull:
+            # another upload took the last slot while this one was being read
+            os.remove(target_path)
+            if self.dedup_index:
+                self.dedup_index.discard((*partition, name))
+            self.counters['uploads_rejected'] += 1
+            return http_response(503, {'error': "queue full, retry later"}, headers=["Retry-After: 1"])
+        self.counters['uploads_accepted'] += 1
+        return http_response(202, {'status': "queued", 'file': name, 'queue_depth': self.work_queue.qsize()})
+
+    async def requeue_saved_uploads(self):
+        """Queues the screenshots left in the upload dir by a previous run, waiting for room in the queue."""
+        upload_args = argparse.Namespace(**{**vars(self.args), 'dir_path': self.upload_dir})
+        for user_id, device_id, partition_dir in list_partitions(upload_args):
+            for source in iter_dir_screenshots(partition_dir):
+                if not is_already_ingested(self.manifest((user_id, device_id)), source):
+                    image_bytes = await asyncio.to_thread(read_screenshot_bytes, source.path)
+                    if self.dedup_index:
+                        # held again until ingested: the previous run stopped before ingesting it
+                        await asyncio.to_thread(check_duplicate, self.dedup_index, (user_id, device_id, source.name), image_bytes)
+                    await self.work_queue.put(UploadedScreenshot((user_id, device_id), source, image_bytes,
+                                                                 time.monotonic()))
+
+    async def ocr_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            upload = await self.work_queue.get()
+            self.in_flight += 1
+            started_at = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self.executor, functools.partial(
+                    self.extract, upload.source.path, image_bytes=upload.image_bytes))
+            except Exception as e:
+                # e.g. a worker process that died: the screenshot is dead-lettered like any other failure
+                result = (None, ({}, {}), {'kind': "dead_letter", 'error': f"{type(e).__name__}: {e}"})
+            finally:
+                self.in_flight -= 1
+            self.latencies['queue_wait'].append(started_at - upload.received_at)
+            self.latencies['processing'].append(time.monotonic() - started_at)
+            await self.results.put((upload, result))
+
+    def write_batch(self, batch):
+        """Records a batch of finished screenshots: sets failures aside, upserts the rows, saves the manifests."""
+        dirty_partitions = set()
+        for upload, (measurement, worker_metrics, failure) in batch:
+            _stage_metrics.merge(worker_metrics)
+            user_id, device_id = upload.partition
+            if failure is not None:
+                self.counters['files_quarantined' if failure['kind'] == "quarantine" else 'files_failed'] += 1
+                if self.dedup_index:
+                    self.dedup_index.discard((user_id, device_id, upload.source.name))
+                set_aside_screenshot(self.args, upload.source.path, failure, user_id, device_id)
+                continue
+            if self.dedup_index:
+                self.dedup_index.commit((user_id, device_id, upload.source.name))
+            manifest = self.manifest(upload.partition)
+            self.pending_rows.append(measurement, user_id, device_id,
+                                     previous_reading_date(manifest, upload.source, measurement))
+            record_ingested(manifest, upload.source, measurement.as_dict())
+            dirty_partitions.add(upload.partition)
+            self.counters['files_processed'] += 1
+
+        if self.pending_rows:
+            try:
+                with stage_timer('store_write'):
+                    self.store.upsert(self.pending_rows.to_frame(), self.pending_rows.replaced_keys())
+            except Exception as e:
+                # e.g. a workbook locked by Excel: the rows are kept and written with the next batch
+                print(f"Error: cannot write the measurement store, {len(self.pending_rows)} row(s) kept for the next batch: {e}")
+                return
+            self.pending_rows.clear()
+        with stage_timer('manifest_write'):
+            for partition in dirty_partitions:
+                manifest_path, manifest = self.manifests[partition]
+                save_manifest(manifest, manifest_path)
+            if self.dedup_index:
+                self.dedup_index.save()
+
+    async def write_results(self):
+        while True:
+            batch = [await self.results.get()]
+            while not self.results.empty():
+                batch.append(self.results.get_nowait())
+            # the store and manifest writes are blocking file I/O, kept off the event loop
+            await asyncio.to_thread(self.write_batch, batch)
+            now = time.monotonic()
+            for upload, _ in batch:
+                self.latencies['total'].append(now - upload.received_at)
+            print(f"Ingested {len(batch)} screenshot(s), {self.work_queue.qsize()} waiting")
+
+    async def run(self):
+        """Serves until cancelled (Ctrl+C)."""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.work_queue = asyncio.Queue(maxsize=max(1, self.args.queue_size))
+        self.results = asyncio.Queue()
+        self.executor = create_ocr_executor(self.args, self.workers)
+        server = await asyncio.start_server(self.handle_connection, self.args.host, self.args.port)
+        tasks = [asyncio.create_task(self.ocr_worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self.write_results()))
+        tasks.append(asyncio.create_task(self.requeue_saved_uploads()))
+        print(f"Serving on http://{self.args.host}:{self.args.port} (POST /upload?name=<file>.jpg, GET /status; Ctrl+C to stop)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.executor:
+                self.executor.shutdown(cancel_futures=True)
+            if self.pending_rows:
+                self.write_batch([])
+            evict_ocr_cache(self.args)
+
+
+def run_service(args):
+    """Runs the UploadService until Ctrl+C."""
+    try:
+        asyncio.run(UploadService(args).run())
+    except KeyboardInterrupt:
+        print("Stopping the upload service")
+    except OSError as e:
+        # e.g. the port is already in use
+        print(f"Error: cannot serve on {args.host}:{args.port}: {e}")
+        sys.exit(1)
+
+# Tesseract executable path (elsewhere than on Windows, tesseract is looked up on the PATH)
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-    # checks whether the dir with the source jpeg file(s) exist 
-    if not os.path.exists(args.dir_path):
-        print(" ****************** cannot find jpeg file or jpeg file has the wrong name **********************")
-        sys.exit
+#  ------------------------------ PLOTTING ------------------------------------------------------
 
-    process_jpg_files (args)
+def load_correlation_matrix(store, user_id=None, window_days=0):
+    """
+    Returns the inter-variable correlation matrix of the body stats saved in the measurement store,
+    restricted to the readings of user_id when it is given (partitioned stores only) and to the
+    last window_days days when it is set, with the trend of every metric over the same readings.
 
-if __name__ == "__main__":
-    main()
+    Both come from the store's incremental statistics, so the store itself is not read.
 
-#  ------------------------------ PLOTTING ------------------------------------------------------
+    Returns:
+        tuple: (corr_matrix, trends), see RunningMoments
+    """
+    moments = store.current_statistics(window_days).moments(user_id, window_days)
+    return moments.correlation(), moments.trends()
 
-args=parse_args()
 
-# Inter-Variable Correlation Matrix
-df = pd.read_excel(args.path_output_xls)
-df_noDate = df.drop(columns=['Reading_Date'])
-corr_matrix = df_noDate.corr()
+def print_trends(trends, window_days=0):
+    """Prints the mean and trend (change per 30 days) of every metric."""
+    print(f"Trends over {f'the last {window_days} days' if window_days else 'the whole history'}:")
+    for metric, row in trends.iterrows():
+        print(f"{metric:>30}: {int(row['Readings']):5d} readings, mean {row['Mean']:9.3f}, "
+              f"{row['Slope_per_day'] * 30:+9.3f} per 30 days")
 
-#  ------------------------------ 1st PLOT ------------------------------------------------------
 
-# Generates a correlation matrix visualizing the relationships between all collected body statistic pairs
-# from ArboLeaf app screenshots.
+def finish_figure(headless, png_path):
+    """Saves the current matplotlib figure as a PNG in headless mode, otherwise shows it."""
+    import matplotlib.pyplot as plt
 
-plt.figure(figsize=(10, 10))
-sns.heatmap(corr_matrix, annot=True, cmap='coolwarm')
-plt.title('Correlation Matrix - All Variables')
-plt.xticks(rotation=25, ha='right', size=9)
-plt.tight_layout()
-plt.show()
+    if headless:
+        plt.savefig(png_path, dpi=150, bbox_inches='tight')
+        plt.close()
+    else:
+        plt.show()
 
-#  ------------------------------ 2nd PLOT ------------------------------------------------------
+#  ------------------------------ 1st PLOT ------------------------------------------------------
+
+def plot_correlation_matrix(corr_matrix, headless, png_path):
+    """
+    Generates a correlation matrix visualizing the relationships between all collected body statistic pairs
+    from ArboLeaf app screenshots.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-# Generates a correlation matrix visualization of the relationships between all collected body statistic 
-# pairs from ArboLeaf app screenshots, eliminating the main diagonal and filtering for those 
-# abs(correlations) above a given threshold. 
+    plt.figure(figsize=(10, 10))
+    sns.heatmap(corr_matrix, annot=True, cmap='coolwarm')
+    plt.title('Correlation Matrix - All Variables')
+    plt.xticks(rotation=25, ha='right', size=9)
+    plt.tight_layout()
+    finish_figure(headless, png_path)
 
-# sets a correlation threshold (e.g., 0.8)
-corr_threshold = 0.8
+#  ------------------------------ 2nd PLOT ------------------------------------------------------
 
-# creates a deep copy of the original corr matrix df
-corr_matrix_copy = copy.deepcopy(corr_matrix)
+def plot_filtered_correlation_matrix(corr_matrix, corr_threshold, headless, png_path):
+    """
+    Generates a correlation matrix visualization of the relationships between all collected body statistic 
+    pairs from ArboLeaf app screenshots, eliminating the main diagonal and filtering for those 
+    abs(correlations) above a given threshold (e.g., 0.8). 
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-# create a boolean mask for the upper triangular part of the corr matrix df
-# (while keeping the diagonal), using k=1 that means all elements above the
-# diagonal are included.
-mask = np.triu(np.ones_like(corr_matrix_copy, dtype=bool), k=1)
+    # create a boolean mask for the upper triangular part of the corr matrix df
+    # (while keeping the diagonal), using k=1 that means all elements above the
+    # diagonal are included.
+    mask = np.triu(np.ones_like(corr_matrix, dtype=bool), k=1)
 
-# apply the mask to corr matrix df to set the upper triang part of it to NaN
-filtered_corr = corr_matrix_copy.where(~mask)
+    # apply the mask to a new copy of the corr matrix df to set the upper triang part of it to NaN
+    filtered_corr = corr_matrix.where(~mask)
 
-# removes all cells with abs(values) lower than the threshold
-filtered_corr = filtered_corr.mask(abs(filtered_corr) < corr_threshold)
+    # removes all cells with abs(values) lower than the threshold
+    filtered_corr = filtered_corr.mask(abs(filtered_corr) < corr_threshold)
 
-# removes the main diagonal
-np.fill_diagonal(filtered_corr.values, np.nan)
+    # removes the main diagonal
+    np.fill_diagonal(filtered_corr.values, np.nan)
 
-# plots the filtered correlations using Seaborn
-plt.figure(figsize=(10, 10))  # Adjust figure size as needed
-sns.heatmap(filtered_corr,
-    annot=True,             # display the corr values on the heatmap
-    cmap="coolwarm",        # color map for the heatmap
-    fmt=".2f",              # format annotations to 2 decimal points
-    linewidths=0.5,         # add lines between cells
-    cbar_kws={'label': 'Correlation Coefficient'})
+    # plots the filtered correlations using Seaborn
+    plt.figure(figsize=(10, 10))  # Adjust figure size as needed
+    sns.heatmap(filtered_corr,
+        annot=True,             # display the corr values on the heatmap
+        cmap="coolwarm",        # color map for the heatmap
+        fmt=".2f",              # format annotations to 2 decimal points
+        linewidths=0.5,         # add lines between cells
+        cbar_kws={'label': 'Correlation Coefficient'})
 
-plt.title(f"Correlation Matrix - Variables with abs(corr coef) >= {corr_threshold}")
-plt.xticks(rotation=20, ha='right')
-plt.show()
+    plt.title(f"Correlation Matrix - Variables with abs(corr coef) >= {corr_threshold}")
+    plt.xticks(rotation=20, ha='right')
+    finish_figure(headless, png_path)
 
 #  ------------------------------ 3rd PLOT ------------------------------------------------------
 
-# Displays the correlation matrix values numerically in the upper triangular portion, and their heatmap 
-# visualization where variable-sized squares with color gradients indicate the strength of the correlation coefficients 
-
-# Prepare the figure
-fig, ax = plt.subplots(figsize=(10, 8))
-
-# Normalize correlation values for the colormap
-norm = Normalize(vmin=-1, vmax=1)
-cmap = plt.cm.coolwarm
-
-# Keep references for interactive cursor
-annotations = []
-
-# Draw lower triangle rounded squares with shadow
-for i in range(len(corr_matrix)):
-    for j in range(i):
-        corr_value = corr_matrix.iloc[i, j]
-        if pd.notnull(corr_value):
-            size = abs(corr_value)
-            color = cmap(norm(corr_value))
-            # Create a rounded box (FancyBboxPatch)
-            box = FancyBboxPatch(
-                (j - size/2, i - size/2),
-                size, size,
-                boxstyle="round,pad=0.02,rounding_size=0.1",
-                linewidth=0.5, edgecolor='grey', facecolor=color
-            )
-            # Add shadow path effect
-            box.set_path_effects([path_effects.SimpleLineShadow(offset=(1, -1), alpha=0.3),
-                                  path_effects.Normal()])
-            ax.add_patch(box)
-
-            # Store for cursor interactivity
-            annotations.append((box, corr_value))
-
-# Draw correlation numbers in the upper triangle, colored by correlation
-texts = []
-for i in range(len(corr_matrix)):
-    for j in range(i+1, len(corr_matrix)):
-        corr_value = corr_matrix.iloc[i, j]
-        if pd.notnull(corr_value):
-            color = cmap(norm(corr_value))
-            txt = ax.text(j, i, f"{corr_value:.2f}", ha='center', va='center',
-                          fontsize=9, color=color)
-            texts.append((txt, corr_value))
-
-# Set ticks
-ax.set_xticks(np.arange(len(corr_matrix)))
-ax.set_yticks(np.arange(len(corr_matrix)))
-ax.xaxis.set_ticks_position('top')
-ax.xaxis.set_label_position('top')
-ax.set_xticklabels(corr_matrix.columns, rotation=90)
-ax.set_yticklabels(corr_matrix.columns)
-
-# Set limits and aspect ratio
-ax.set_xlim(-0.5, len(corr_matrix)-0.5)
-ax.set_ylim(len(corr_matrix)-0.5, -0.5)
-ax.set_aspect('equal')
-
-# Add subtle dashed light silver gridlines
-ax.grid(which='both', color='lightgrey', linestyle='--', linewidth=0.7, alpha=0.5)
-
-# Add colorbar
-sm = ScalarMappable(cmap=cmap, norm=norm)
-sm.set_array([])
-cbar = plt.colorbar(sm, ax=ax, fraction=0.046, pad=0.04)
-cbar.set_label('Correlation')
-
-# Add interactive hover tooltips
-cursor = mplcursors.cursor(highlight=True)
-
-# Add tooltips for boxes and texts
-@cursor.connect("add")
-def on_add(sel):
-    for artist, corr_value in annotations + texts:
-        if sel.artist == artist:
+def plot_split_correlation_matrix(corr_matrix, headless, png_path):
+    """
+    Displays the correlation matrix values numerically in the upper triangular portion, and their heatmap 
+    visualization where variable-sized squares with color gradients indicate the strength of the correlation coefficients 
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import FancyBboxPatch
+    from matplotlib.collections import PatchCollection
+    from matplotlib.colors import Normalize
+    from matplotlib.cm import ScalarMappable
+    import matplotlib.patheffects as path_effects
+
+    # Prepare the figure
+    fig, ax = plt.subplots(figsize=(10, 8))
+
+    # Normalize correlation values for the colormap
+    norm = Normalize(vmin=-1, vmax=1)
+    cmap = plt.cm.coolwarm
+
+    values = corr_matrix.to_numpy()
+
+    # Lower triangle cells (diagonal excluded) holding a correlation value
+    rows, cols = np.tril_indices(len(corr_matrix), k=-1)
+    lower_values = values[rows, cols]
+    keep = ~np.isnan(lower_values)
+    rows, cols, lower_values = rows[keep], cols[keep], lower_values[keep]
+    sizes = np.abs(lower_values)
+
+    # Draw lower triangle rounded squares with shadow, as a single collection
+    boxes = [FancyBboxPatch((j - size/2, i - size/2), size, size,
+                            boxstyle="round,pad=0.02,rounding_size=0.1")
+             for i, j, size in zip(rows, cols, sizes)]
+    box_collection = PatchCollection(boxes, facecolors=cmap(norm(lower_values)),
+                                     edgecolors='grey', linewidths=0.5)
+    # Add shadow path effect
+    box_collection.set_path_effects([path_effects.SimpleLineShadow(offset=(1, -1), alpha=0.3),
+                                     path_effects.Normal()])
+    ax.add_collection(box_collection)
+
+    # Draw correlation numbers in the upper triangle, colored by correlation
+    rows, cols = np.triu_indices(len(corr_matrix), k=1)
+    upper_values = values[rows, cols]
+    keep = ~np.isnan(upper_values)
+    rows, cols, upper_values = rows[keep], cols[keep], upper_values[keep]
+
+    # Keep references for interactive cursor
+    texts = {}
+    for i, j, corr_value, color in zip(rows, cols, upper_values, cmap(norm(upper_values))):
+        txt = ax.text(j, i, f"{corr_value:.2f}", ha='center', va='center',
+                      fontsize=9, color=color)
+        texts[txt] = corr_value
+
+    # Set ticks
+    ax.set_xticks(np.arange(len(corr_matrix)))
+    ax.set_yticks(np.arange(len(corr_matrix)))
+    ax.xaxis.set_ticks_position('top')
+    ax.xaxis.set_label_position('top')
+    ax.set_xticklabels(corr_matrix.columns, rotation=90)
+    ax.set_yticklabels(corr_matrix.columns)
+
+    # Set limits and aspect ratio
+    ax.set_xlim(-0.5, len(corr_matrix)-0.5)
+    ax.set_ylim(len(corr_matrix)-0.5, -0.5)
+    ax.set_aspect('equal')
+
+    # Add subtle dashed light silver gridlines
+    ax.grid(which='both', color='lightgrey', linestyle='--', linewidth=0.7, alpha=0.5)
+
+    # Add colorbar
+    sm = ScalarMappable(cmap=cmap, norm=norm)
+    sm.set_array([])
+    cbar = plt.colorbar(sm, ax=ax, fraction=0.046, pad=0.04)
+    cbar.set_label('Correlation')
+
+    if not headless:
+        import mplcursors
+
+        # Add interactive hover tooltips
+        cursor = mplcursors.cursor(highlight=True)
+
+        # Add tooltips for boxes and texts
+        @cursor.connect("add")
+        def on_add(sel):
+            if sel.artist is box_collection:
+                corr_value = lower_values[int(np.ravel(sel.index)[0])]
+            elif sel.artist in texts:
+                corr_value = texts[sel.artist]
+            else:
+                return
             sel.annotation.set_text(f"Corr: {corr_value:.2f}")
             sel.annotation.get_bbox_patch().set(fc="white", alpha=0.8)
-            break
 
-plt.tight_layout()
-plt.title("Correlation Matrix \n Split numerical and heatmap", loc='left', x=-0.40, y=1.25)
-plt.show()
+    plt.tight_layout()
+    plt.title("Correlation Matrix \n Split numerical and heatmap", loc='left', x=-0.40, y=1.25)
+    finish_figure(headless, png_path)
 
 #  ------------------------------ 4th PLOT ------------------------------------------------------
 
@@ -531,57 +3614,51 @@ def signed_blocks(v):
 # number of discrete colors to sample from the colormap
 cmap_numb_discr_colors = 65355 + 1      # leave the + 1 to ensure color normalized values range from 0 to 1
 
-def mpl_to_plotly(cmap_name, n=cmap_numb_discr_colors):
+# number of stops of the Plotly colorscale embedded in the HTML output
+plotly_colorscale_stops = 64
+
+def colormap_rgb_table(cmap_name, n=cmap_numb_discr_colors):
+    """
+    Samples a Matplotlib colormap once into an (n, 3) uint8 RGB array, used as
+    a lookup table by index instead of re-sampling the colormap per value.
+    """
+    import matplotlib.pyplot as plt
+
+    cmap = plt.get_cmap(cmap_name)
+    return (cmap(np.linspace(0, 1, n))[:, :3] * 255).astype(np.uint8)
+
+def mpl_to_plotly(rgb_table, n=plotly_colorscale_stops):
     """
     Creates a Plotly colorscale that tries to match a Matplotlib's colormap
     
     Parameters:
-    - n: number of discrete colors to sample from the colormap (default:cmap_numb_discr_colors)
+    - rgb_table: colormap lookup table from colormap_rgb_table
+    - n: number of stops of the colorscale, evenly picked from the table (default:plotly_colorscale_stops)
     
     Returns:
     - A list of lists representing the Plotly colorscale
     """
-
-    # Gets the colormap from matplotlib
-    cmap = plt.get_cmap(cmap_name)
-
-    scale = []
+    positions = np.linspace(0, 1, n)
+    stops = rgb_table[np.rint(positions * (len(rgb_table) - 1)).astype(int)]
 
     # Converts to Plotly format: list of [position, rgb] pairs
-    for i in range(n):
-        v = i / (n - 1)
-        rgb = cmap(v)[:3]
-        rgb_str = f"rgb({int(rgb[0]*255)}, {int(rgb[1]*255)}, {int(rgb[2]*255)})"
-        scale.append([v, rgb_str])
+    return [[float(v), f"rgb({r}, {g}, {b})"] for v, (r, g, b) in zip(positions, stops)]
 
-    return scale
-
-def get_rgba_from_custom_cmap(v, colorscale, alpha=1.0):
+def get_rgba_from_rgb_table(values, rgb_table, alpha=1.0):
     """
-    Given a value in [-1,1], normalize to [0,1] and return an rgba string
-    based on the custom Plotly colorscale (format must be [[float, 'rgb(...)'],...]).
+    Given an array of values in [-1,1], normalize them to [0,1] and return an
+    array of rgba strings of the same shape, read from the colormap lookup table.
+    The table stops are evenly spaced, so the nearest stop is found by rounding.
     """
-    # Normalize to 0-1
-    norm_v = (v + 1) / 2
-    # Ensure it's between 0 and 1
-    norm_v = max(0, min(norm_v, 1))
-
-    # Find nearest stop in colorscale
-    distances = [abs(norm_v - stop[0]) for stop in colorscale]
-    idx = distances.index(min(distances))
-
-    # Extract RGB string
-    rgb_str = colorscale[idx][1]  # e.g. "rgb(230,97,1)"
-    
-    # Parse to retrieve integer components
-    rgb_parts = rgb_str.strip("rgb()").split(",")
-    r, g, b = [int(x) for x in rgb_parts]
+    # Normalize to 0-1 and ensure values are between 0 and 1 (NaN cells get the middle color)
+    norm_v = np.clip((np.nan_to_num(np.asarray(values, dtype=float)) + 1) / 2, 0, 1)
 
-    # Build rgba string 
-    return f"rgba({r},{g},{b},{alpha})"
+    # Index of the nearest stop in the table
+    idx = np.rint(norm_v * (len(rgb_table) - 1)).astype(int)
 
-# Builds the custom color Plotly scale that tries to match Matplotlib's colomap
-custom_colorscale = mpl_to_plotly('coolwarm', cmap_numb_discr_colors)
+    # Build rgba strings
+    rgba = [f"rgba({r},{g},{b},{alpha})" for r, g, b in rgb_table[idx.ravel()]]
+    return np.array(rgba, dtype=object).reshape(idx.shape)
 
 clusters = {'Weight':'Body Metrics','BMI':'Body Metrics','Body Fat':'Body Composition',
  'Skeletal Muscle':'Body Composition','Muscle Mass':'Body Composition',
@@ -591,89 +3668,531 @@ clusters = {'Weight':'Body Metrics','BMI':'Body Metrics','Body Fat':'Body Compos
 
 colors = {'Body Metrics':'blue','Body Composition':'brown','Metabolic':'green'}
 
-fig = go.Figure()
 
-# Creates scatter squares grouped by cluster
-for cluster_name, border_color in colors.items():
-    x_vals = []; y_vals = []; sizes = []; fill_colors = []; hover_texts = []
-    
-    for i in range(len(corr_matrix)):
-        for j in range(len(corr_matrix)):
-            if i == j:
-                # faint diagonal
-                x_vals.append(corr_matrix.columns[j])
-                y_vals.append(corr_matrix.columns[i])
-                sizes.append(10)  # fixed small size
-                fill_colors.append("rgba(200,200,200,1.0)")  # faint light gray
-                hover_texts.append(f"<b>Corr:</b> 1.00<br><i>Diagonal</i>")
-                continue
-            
-            v = corr_matrix.iloc[i, j]
-            
-            var_cluster = clusters.get(corr_matrix.columns[j], 'Other')
-            
-            if pd.notnull(v) and var_cluster == cluster_name:
-                x_vals.append(corr_matrix.columns[j])
-                y_vals.append(corr_matrix.columns[i])
-                sizes.append(abs(v)*40)
-                fill_colors.append(get_rgba_from_custom_cmap(v, custom_colorscale, 1.0))
-                hover_texts.append(
-                    f"<b style='color:#222'>Corr:</b> <span style='color:#c084fc'>{v:.2f}</span><br>"
-                    f"<span style='color:#d8b4fe'><i>Cluster: {cluster_name}</i></span><br>"
-                    f"<span style='font-family:monospace;color:#c084fc'>{mini_plusminus(v)}</span>"
-                )
+def plot_interactive_correlation_matrix(corr_matrix, html_path):
+    """
+    Writes the interactive HTML correlation matrix, with squares grouped and
+    border-colored by cluster, to html_path.
+    """
+    import plotly.graph_objects as go
+
+    # Builds the custom color Plotly scale that tries to match Matplotlib's colomap,
+    # and the fill colors of the whole matrix in a single lookup
+    rgb_table = colormap_rgb_table('coolwarm', cmap_numb_discr_colors)
+    custom_colorscale = mpl_to_plotly(rgb_table, plotly_colorscale_stops)
+    fill_color_matrix = get_rgba_from_rgb_table(corr_matrix.to_numpy(), rgb_table, 1.0)
+
+    fig = go.Figure()
+
+    # Builds every cell's marker size, fill color and hover text in a single pass
+    values = corr_matrix.to_numpy()
+    n = len(corr_matrix)
+    names = np.array(corr_matrix.columns, dtype=object)
+    rows, cols = np.divmod(np.arange(n * n), n)
+    flat_values = values.ravel()
+    col_clusters = np.array([clusters.get(name, 'Other') for name in corr_matrix.columns], dtype=object)[cols]
+
+    diagonal = rows == cols
+    valid = ~diagonal & ~np.isnan(flat_values)
+
+    sizes = np.where(diagonal, 10, np.abs(np.nan_to_num(flat_values)) * 40)  # fixed small size on the diagonal
+    fill_colors = np.where(diagonal, "rgba(200,200,200,1.0)", fill_color_matrix.ravel())  # faint light gray diagonal
+    hover_texts = np.full(n * n, "<b>Corr:</b> 1.00<br><i>Diagonal</i>", dtype=object)
+    hover_texts[valid] = [
+        f"<b style='color:#222'>Corr:</b> <span style='color:#c084fc'>{v:.2f}</span><br>"
+        f"<span style='color:#d8b4fe'><i>Cluster: {cluster_name}</i></span><br>"
+        f"<span style='font-family:monospace;color:#c084fc'>{mini_plusminus(v)}</span>"
+        for v, cluster_name in zip(flat_values[valid], col_clusters[valid])
+    ]
+
+    # Creates scatter squares grouped by cluster (of the x variable); every trace
+    # also carries the faint diagonal
+    for cluster_name, border_color in colors.items():
+        in_trace = diagonal | (valid & (col_clusters == cluster_name))
+        fig.add_trace(go.Scatter(
+            x=names[cols[in_trace]], y=names[rows[in_trace]], mode='markers',
+            marker=dict(symbol='square', size=sizes[in_trace], color=fill_colors[in_trace], 
+                        line=dict(color=border_color, width=2)),
+            text=hover_texts[in_trace], hoverinfo='text',
+            name=cluster_name,
+            legendgroup=cluster_name,
+            # legendgrouptitle_text="Clusters",
+            showlegend=True
+        ))
+
+    # Configure layout
+    col_order = list(corr_matrix.columns)
+
+    fig.update_layout(
+        xaxis=dict(categoryorder="array", categoryarray=col_order, side='top'),
+        yaxis=dict(categoryorder="array", categoryarray=col_order, autorange='reversed'),
+        title=dict(text='Interactive Correlation Matrix', y=0.97),
+        width=1200, height=1000,
+        plot_bgcolor='white',
+        legend=dict(title='<b>Clusters</b>', x=1.05, y=0.9,
+                    bgcolor='rgba(255,255,255,0.6)', bordercolor='grey', borderwidth=1),
+        hoverlabel=dict(
+            bgcolor="#fef9c7",  # pale lemon yellow
+            font_size=12,
+            font_family="Arial"
+        )
+    )
+
+    # Creates scatter for colorbar legend based on custom colorscale
+    z_vals = np.linspace(-1, 1, plotly_colorscale_stops)
+
+    # Builds a color legend based on the customized Plotly colorscale 
+    # that tries to match matplotlib's selected color pallette
     fig.add_trace(go.Scatter(
-        x=x_vals, y=y_vals, mode='markers',
-        marker=dict(symbol='square', size=sizes, color=fill_colors, 
-                    line=dict(color=border_color, width=2)),
-        text=hover_texts, hoverinfo='text',
-        name=cluster_name,
-        legendgroup=cluster_name,
-        # legendgrouptitle_text="Clusters",
-        showlegend=True
+        x=[None]*len(z_vals),
+        y=[None]*len(z_vals),
+        mode='markers',
+        marker=dict(
+            size=0.001,
+            color=z_vals,
+            colorscale=custom_colorscale,
+            cmin=-1, cmax=1,
+            colorbar=dict(
+                title="Correlation<br>Strength",
+                x=1.12,      # <<<-- shifts colorbar to the RHS of the correlation matrix
+                len=0.7,
+                y=0.4
+            )
+        ),
+        showlegend=False
     ))
 
-# Configure layout
-col_order = list(corr_matrix.columns)
-
-fig.update_layout(
-    xaxis=dict(categoryorder="array", categoryarray=col_order, side='top'),
-    yaxis=dict(categoryorder="array", categoryarray=col_order, autorange='reversed'),
-    title=dict(text='Interactive Correlation Matrix', y=0.97),
-    width=1200, height=1000,
-    plot_bgcolor='white',
-    legend=dict(title='<b>Clusters</b>', x=1.05, y=0.9,
-                bgcolor='rgba(255,255,255,0.6)', bordercolor='grey', borderwidth=1),
-    hoverlabel=dict(
-        bgcolor="#fef9c7",  # pale lemon yellow
-        font_size=12,
-        font_family="Arial"
-    )
-)
-
-# Creates scatter for colorbar legend based on custom colorscale
-z_vals = np.linspace(-1, 1, cmap_numb_discr_colors)
-
-# Builds a color legend based on the customized Plotly colorscale 
-# that tries to match matplotlib's selected color pallette
-fig.add_trace(go.Scatter(
-    x=[None]*len(z_vals),
-    y=[None]*len(z_vals),
-    mode='markers',
-    marker=dict(
-        size=0.001,
-        color=z_vals,
-        colorscale=custom_colorscale,
-        cmin=-1, cmax=1,
-        colorbar=dict(
-            title="Correlation<br>Strength",
-            x=1.12,      # <<<-- shifts colorbar to the RHS of the correlation matrix
-            len=0.7,
-            y=0.4
-        )
-    ),
-    showlegend=False
-))
+    fig.write_html(html_path)
+
+#  ------------------------------ REPORT ------------------------------------------------------
+
+def run_report(args):
+    """
+    Draws the four correlation plots from the body stats saved in the measurement store.
+
+    In headless mode the matplotlib plots are saved as Figure_1.png ... Figure_3.png
+    instead of being shown; the interactive matrix is always written as
+    correlation_svg_curved_clusters.html. Files go to args.output_dir, or next
+    to the Excel file when it is not set.
+    """
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.path_output_xls))
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.headless:
+        # the non-interactive backend must be selected before pyplot is first imported
+        import matplotlib
+        matplotlib.use('Agg')
+
+    if args.user_id is not None and not args.partitioned:
+        print("Error: --user_id requires --partitioned")
+        sys.exit(1)
+
+    corr_matrix, trends = load_correlation_matrix(open_store(args), args.user_id, args.window_days)
+    print_trends(trends, args.window_days)
+
+    plot_correlation_matrix(corr_matrix, args.headless, os.path.join(output_dir, 'Figure_1.png'))
+    plot_filtered_correlation_matrix(corr_matrix, args.corr_threshold, args.headless, os.path.join(output_dir, 'Figure_2.png'))
+    plot_split_correlation_matrix(corr_matrix, args.headless, os.path.join(output_dir, 'Figure_3.png'))
+    plot_interactive_correlation_matrix(corr_matrix, os.path.join(output_dir, 'correlation_svg_curved_clusters.html'))
+
+# ------------------------------- SYNTHETIC BENCHMARK -------------------------------------------
+
+# the synthetic page is drawn at the size of the Images/ sample screenshot, then resized
+SYNTHETIC_REFERENCE_SIZE = (1080, 2316)
+
+# (low, high, decimals) of the random value drawn for each metric, in the units the app displays
+SYNTHETIC_VALUE_RANGES = {
+    'Weight': (100.0, 250.0, 1),
+    'Body Fat': (8.0, 40.0, 1),
+    'BMI': (17.0, 38.0, 1),
+    'Skeletal Muscle': (35.0, 60.0, 1),
+    'Muscle Mass': (70.0, 180.0, 1),
+    'Muscle Storage Ability Level': (1, 10, 0),
+    'Protein': (12.0, 22.0, 1),
+    'BMR': (1200, 2400, 0),
+    'Fat-Free Body Weight': (80.0, 190.0, 1),
+    'Subcutaneous Fat': (8.0, 35.0, 1),
+    'Visceral Fat': (1, 20, 0),
+    'Body Water': (40.0, 65.0, 1),
+    'Bone Mass': (4, 12, 0),
+}
+
+SYNTHETIC_UNITS = {spec.name: spec.unit for spec in MEASUREMENT_SCHEMA if spec.unit}
+
+SYNTHETIC_LABELS = {'Muscle Storage Ability Level': ['Muscle Storage', 'Ability Level'],
+                    'Fat-Free Body Weight': ['Fat-free Body', 'Weight']}
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_font(size, bold=False):
+    """Returns a scalable font: DejaVu Sans or Arial if installed, otherwise Pillow's bundled default font."""
+    names = ('DejaVuSans-Bold.ttf', 'arialbd.ttf') if bold else ('DejaVuSans.ttf', 'arial.ttf')
+    for name in names:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def random_display_values(rng):
+    """Returns the 13 metric values as the app displays them, in METRIC_NAMES order."""
+    values = []
+    for metric in METRIC_NAMES:
+        low, high, decimals = SYNTHETIC_VALUE_RANGES[metric]
+        if decimals == 0:
+            values.append(str(int(rng.integers(low, high + 1))))
+        else:
+            values.append(f"{rng.uniform(low, high):.{decimals}f}")
+    return values
+
+
+def draw_value_with_unit(draw, center_x, baseline_y, value, unit, value_size, unit_size):
+    """Draws a metric value centered on center_x, followed by its smaller unit on the same baseline."""
+    value_font = synthetic_font(value_size, bold=True)
+    value_width = draw.textlength(value, font=value_font)
+    draw.text((center_x, baseline_y), value, font=value_font, fill=(40, 40, 40), anchor='ms')
+    if unit:
+        draw.text((center_x + value_width / 2 + 6, baseline_y), unit, font=synthetic_font(unit_size), fill=(60, 60, 60), anchor='ls')
+
+
+def render_synthetic_screenshot(values, reading_time, size, noise_sigma, rng):
+    """
+    Draws an ArboLeaf-style "Measurement Details" page with known metric values.
+
+    The layout and colors follow the Images/ sample: status bar and title, the
+    grey date, the Weight card with its grey scale labels, then the 3 x 4 grid
+    of metric tiles. The page is drawn at SYNTHETIC_REFERENCE_SIZE, resized to
+    size and overlaid with gaussian pixel noise.
+
+    Args:
+        values (list[str]): Displayed metric values, in METRIC_NAMES order
+        reading_time (datetime.datetime): Time shown by the status bar clock, and date shown under the title
+        size (tuple[int, int]): (width, height) of the screenshot
+        noise_sigma (float): Standard deviation of the pixel noise (0 = clean)
+        rng (np.random.Generator): Source of the noise
+
+    Returns:
+        np.ndarray: BGR screenshot
+    """
+    page = Image.new('RGB', SYNTHETIC_REFERENCE_SIZE, (243, 244, 246))
+    draw = ImageDraw.Draw(page)
+    center_x = SYNTHETIC_REFERENCE_SIZE[0] // 2
+
+    # status bar, title and date
+    draw.rectangle((0, 0, SYNTHETIC_REFERENCE_SIZE[0], 200), fill=(255, 255, 255))
+    draw.text((40, 46), f"{reading_time.hour}:{reading_time.minute:02d}", font=synthetic_font(38), fill=(60, 60, 60), anchor='lm')
+    draw.text((1040, 46), "88%", font=synthetic_font(38), fill=(60, 60, 60), anchor='rm')
+    draw.text((center_x, 137), "Measurement Details", font=synthetic_font(50, bold=True), fill=(40, 40, 40), anchor='mm')
+    draw.text((center_x, 275), reading_time.strftime('%m/%d/%Y'), font=synthetic_font(44), fill=(150, 150, 150), anchor='mm')
+
+    # Weight card
+    weight = float(values[0])
+    draw.rounded_rectangle((46, 352, 1034, 950), radius=24, fill=(255, 255, 255))
+    draw.text((center_x, 410), "Weight", font=synthetic_font(38), fill=(140, 140, 140), anchor='mm')
+    draw_value_with_unit(draw, center_x - 20, 555, values[0], 'lb', 120, 34)
+    draw.text((center_x - 40, 615), "Normal", font=synthetic_font(38), fill=(76, 185, 130), anchor='mm')
+    for x, factor in ((315, 0.75), (540, 1.0), (765, 1.2)):
+        draw.text((x, 708), f"{weight * factor:.1f}lb", font=synthetic_font(30), fill=(150, 150, 150), anchor='mm')
+    for x0, x1, color in ((95, 318, (66, 153, 225)), (318, 540, (76, 185, 130)), (540, 765, (230, 180, 50)), (765, 988, (225, 120, 60))):
+        draw.rectangle((x0, 752, x1, 764), fill=color)
+    for x, label in ((205, "Underweight"), (430, "Normal"), (653, "Overweight"), (877, "Obesity")):
+        draw.text((x, 806), label, font=synthetic_font(36), fill=(50, 50, 50), anchor='mm')
+    draw.text((center_x, 882), "One of the important indicators of health", font=synthetic_font(36), fill=(50, 50, 50), anchor='mm')
+
+    # 3 x 4 grid of metric tiles
+    for k, metric in enumerate(METRIC_NAMES[1:]):
+        left = 46 + (k % 3) * 341
+        top, tile_height = ((1010, 200), (1246, 244), (1527, 244), (1809, 200))[k // 3]
+        tile_center_x = left + 153
+        draw.rounded_rectangle((left, top, left + 306, top + tile_height), radius=20, fill=(255, 255, 255))
+        label_lines = SYNTHETIC_LABELS.get(metric, [metric])
+        for line_index, line in enumerate(label_lines):
+            line_y = top + tile_height * 0.3 + (line_index - (len(label_lines) - 1) / 2) * 46
+            draw.text((tile_center_x, line_y), line, font=synthetic_font(36), fill=(140, 140, 140), anchor='mm')
+        draw_value_with_unit(draw, tile_center_x - 10, top + tile_height - 40, values[k + 1], SYNTHETIC_UNITS.get(metric, ''), 62, 32)
+
+    # navigation bar
+    draw.rectangle((0, 2185, SYNTHETIC_REFERENCE_SIZE[0], SYNTHETIC_REFERENCE_SIZE[1]), fill=(0, 0, 0))
+
+    image = cv2.cvtColor(np.asarray(page), cv2.COLOR_RGB2BGR)
+    if tuple(size) != SYNTHETIC_REFERENCE_SIZE:
+        image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+    if noise_sigma > 0:
+        image = np.clip(image + rng.normal(0.0, noise_sigma, image.shape), 0, 255).astype(np.uint8)
+    return image
+
+
+def generate_synthetic_screenshots(dir_path, count, size, noise_sigma, rng):
+    """
+    Writes count synthetic screenshots to dir_path, named after consecutive
+    reading dates like the app's screenshots (YYYY_MM_DD.jpg), each taken at
+    some time between 6:00 and 9:00 shown by its status bar clock.
+
+    Returns:
+        dict: The expected Measurement of each screenshot, keyed by Reading_Date
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    expected = {}
+    first_time = datetime.datetime(2024, 1, 1, 6, 0)
+    for k in range(count):
+        reading_time = first_time + datetime.timedelta(days=k, minutes=(k * 37) % 180)
+        values = random_display_values(rng)
+        image = render_synthetic_screenshot(values, reading_time, size, noise_sigma, rng)
+        cv2.imwrite(os.path.join(dir_path, reading_time.strftime('%Y_%m_%d') + '.jpg'), image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        reading_date = reading_time.strftime(READING_TIMESTAMP_FORMAT)
+        expected[reading_date] = build_measurement(values, reading_date)
+    return expected
+
+
+def nudge_display_value(value):
+    """Returns a displayed metric value changed by one unit of its last digit, e.g. '45.3' -> '45.4'."""
+    decimals = len(value.partition('.')[2])
+    return f"{float(value) + 10 ** -decimals:.{decimals}f}"
+
+
+def check_duplicate_detection(index_path, size, noise_sigma, rng, threshold):
+    """
+    Regression check of the DuplicateIndex on a synthetic reading: its copies
+    (recompressed, resized to 3/4 of its width and down to twice DEDUP_PAGE_WIDTH) must be found, and
+    no near-identical reading (one metric changed by its last digit, the same
+    values on the next day or at the next minute) may be taken for a copy.
+
+    Returns:
+        dict: The names of the 'missed_copies' and of the 'false_duplicates'
+    """
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    dedup_index = DuplicateIndex(index_path, threshold)
+
+    def encode(image, quality=90):
+        return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+    values = random_display_values(rng)
+    reading_time = datetime.datetime(2025, 4, 14, 8, 29)
+    original = render_synthetic_screenshot(values, reading_time, size, noise_sigma, rng)
+    dedup_index.add(('', '', 'original'), screenshot_signature(encode(original)))
+
+    copies = {'recompressed': encode(original, 60)}
+    for name, factor in (('resized_3/4', 0.75), ('resized_small', 2 * DEDUP_PAGE_WIDTH / size[0])):
+        resized_size = (round(size[0] * factor), round(size[1] * factor))
+        copies[name] = encode(cv2.resize(original, resized_size, interpolation=cv2.INTER_AREA))
+    readings = {'next_day': (values, reading_time + datetime.timedelta(days=1)),
+                'next_minute': (values, reading_time + datetime.timedelta(minutes=1))}
+    for k, metric in enumerate(METRIC_NAMES):
+        readings[metric] = (values[:k] + [nudge_display_value(values[k])] + values[k + 1:], reading_time)
+
+    result = {'missed_copies': [], 'false_duplicates': []}
+    for name, image_bytes in copies.items():
+        if dedup_index.find(('', '', name), screenshot_signature(image_bytes)) is None:
+            result['missed_copies'].append(name)
+    for name, (reading_values, reading_time) in readings.items():
+        image_bytes = encode(render_synthetic_screenshot(reading_values, reading_time, size, noise_sigma, rng))
+        if dedup_index.find(('', '', name), screenshot_signature(image_bytes)) is not None:
+            result['false_duplicates'].append(name)
+    return result
+
+
+def metric_values_match(extracted, expected):
+    """Compares an extracted metric with its expected value as numbers; unreadable values never match."""
+    try:
+        return abs(float(extracted) - float(expected)) < 1e-6
+    except (TypeError, ValueError):
+        return False
+
+
+def score_extraction(expected, extracted_df):
+    """
+    Returns the fraction of screenshots whose value was extracted correctly, per metric.
+    Screenshots missing from extracted_df count as wrong for every metric.
+    """
+    extracted = {}
+    if not extracted_df.empty:
+        extracted = {str(row['Reading_Date']): row for row in extracted_df.to_dict('records')}
+    accuracy = {}
+    for metric in METRIC_NAMES:
+        correct = sum(metric_values_match(extracted[date][metric], values[metric])
+                      for date, values in expected.items() if date in extracted)
+        accuracy[metric] = correct / len(expected) if expected else 0.0
+    return accuracy
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size in MB of this process and of its finished
+    worker processes, or (None, None) where the resource module is missing (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+def run_benchmark(args):
+    """
+    Runs the full process_jpg_files pipeline on synthetic screenshots of every
+    resolution/noise variant and reports images per second, the per-stage
+    timings, peak RSS and the per-metric extraction accuracy.
+
+    Each variant gets its own folder (screenshots, Excel store, manifest) under
+    args.output_dir, and the results of all variants are saved in benchmark.json.
+    Every variant also runs check_duplicate_detection, which needs no OCR.
+    """
+    global _stage_metrics
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='arboleaf_benchmark_')
+    resolutions = [tuple(int(v) for v in resolution.split('x')) for resolution in args.resolutions.split(',')]
+    noise_levels = [float(noise) for noise in args.noise_levels.split(',')]
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for size in resolutions:
+        for noise_sigma in noise_levels:
+            variant = f"{size[0]}x{size[1]}_noise{noise_sigma:g}"
+            variant_dir = os.path.join(output_dir, variant)
+            expected = generate_synthetic_screenshots(os.path.join(variant_dir, 'screenshots'), args.count, size, noise_sigma, rng)
+
+            variant_args = argparse.Namespace(**vars(args))
+            variant_args.dir_path = os.path.join(variant_dir, 'screenshots')
+            variant_args.path_output_xls = os.path.join(variant_dir, 'measurements.xlsx')
+            variant_args.force = True
+            variant_args.partitioned = False
+            variant_args.store = 'excel'
+            variant_args.flush_every = 0
+            # every run must OCR the screenshots, or the timings would measure the cache
+            variant_args.no_ocr_cache = True
+            variant_args.dedup = False
+            variant_args.restart = True
+            variant_args.checkpoint_seconds = 0
+            variant_args.prefetch = 0
+
+            _stage_metrics = StageMetrics()
+            start = time.perf_counter()
+            process_jpg_files(variant_args)
+            elapsed = time.perf_counter() - start
+
+            accuracy = score_extraction(expected, load_existing_measurements(variant_args.path_output_xls))
+            rss_main, rss_workers = peak_rss_mb()
+            results.append({'variant': variant, 'images': args.count, 'elapsed_s': elapsed,
+                            'images_per_second': args.count / elapsed if elapsed > 0 else 0.0,
+                            'peak_rss_mb': rss_main, 'peak_worker_rss_mb': rss_workers,
+                            'mean_accuracy': statistics.mean(accuracy.values()), 'accuracy': accuracy,
+                            'failures': _stage_metrics.counters.get('files_failed', 0),
+                            'stages': _stage_metrics.stage_summaries(),
+                            'dedup': check_duplicate_detection(os.path.join(variant_dir, 'dedup_check.sqlite'), size,
+                                                               noise_sigma, rng, args.dedup_threshold)})
+            _stage_metrics.print_summary(elapsed)
+
+    with open(os.path.join(output_dir, 'benchmark.json'), "w", encoding="utf-8") as f:
+        json.dump({'ocr_mode': args.ocr_mode, 'ocr_backend': args.ocr_backend, 'workers': args.workers,
+                   'preprocess_config': load_preprocess_config(args.preprocess_config), 'seed': args.seed,
+                   'variants': results}, f, indent=1)
+
+    print(f"\n{'variant':<24}{'images/s':>10}{'accuracy':>10}{'peak RSS MB':>13}{'worker RSS MB':>15}")
+    for result in results:
+        rss_main = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else 'n/a'
+        rss_workers = f"{result['peak_worker_rss_mb']:.0f}" if result['peak_worker_rss_mb'] is not None else 'n/a'
+        print(f"{result['variant']:<24}{result['images_per_second']:>10.2f}{result['mean_accuracy']:>10.1%}{rss_main:>13}{rss_workers:>15}")
+    for metric in METRIC_NAMES:
+        print(f"{metric:>30}: " + ", ".join(f"{result['accuracy'][metric]:.0%}" for result in results))
+    for result in results:
+        for problem in ('missed_copies', 'false_duplicates'):
+            if result['dedup'][problem]:
+                print(f"Duplicate detection, {result['variant']}: {problem}: {', '.join(result['dedup'][problem])}")
+    if not any(result['dedup']['missed_copies'] or result['dedup']['false_duplicates'] for result in results):
+        print("Duplicate detection: every copy found, no near-identical reading taken for a copy")
+    print(f"Benchmark files and benchmark.json written to {output_dir}")
+
+# ------------------------------- MAIN ----------------------------------------------------------
+
+def run_ingest(args):
+    """
+    Runs the batch or watch ingestion, then reports its stage metrics and,
+    with args.profile, writes the cProfile dump of the run.
+    """
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        if args.watch:
+            watch_jpg_files(args)
+        else:
+            process_jpg_files(args)
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"Profile written to {args.profile} (inspect with: python -m pstats {args.profile})")
+        write_stage_metrics(args, elapsed)
 
 
-fig.write_html('C:/ArboLeaf_Data/correlation_svg_curved_clusters.html')
+def main():
+    """
+    Main function  
+    """
+
+    args = parse_args()
+
+    if args.command == "report":
+        run_report(args)
+        return
+
+    if args.command == "export":
+        open_store(args).export_excel(args.path_output_xls)
+        return
+
+    if args.command == "benchmark":
+        run_benchmark(args)
+        return
+
+    if args.command == "serve":
+        run_service(args)
+        return
+
+    # checks whether the dir with the source jpeg file(s) exist 
+    if not os.path.exists(args.dir_path) and not is_glob_pattern(args.dir_path):
+        print(" ****************** cannot find jpeg file or jpeg file has the wrong name **********************")
+        sys.exit(1)
+
+    if not os.path.isdir(args.dir_path) and (args.watch or args.partitioned or args.benchmark_ocr):
+        # archives and glob patterns are read by batch runs only
+        print("Error: --watch, --partitioned and --benchmark_ocr need --dir_path to be a dir")
+        sys.exit(1)
+
+    if args.benchmark_ocr:
+        init_ocr_backend(args.ocr_backend)
+        jpeg_paths = sorted(entry.path for entry in os.scandir(args.dir_path)
+                            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in ('.jpg', '.jpeg'))
+        benchmark_ocr_paths(jpeg_paths, load_preprocess_config(args.preprocess_config))
+        benchmark_ocr_backends(jpeg_paths, load_preprocess_config(args.preprocess_config))
+        return
+
+    if args.watch and args.partitioned:
+        # the watcher follows a single folder; partitioned trees are ingested in batch runs
+        print("Error: --watch does not support --partitioned")
+        sys.exit(1)
+
+    run_ingest(args)
+
+    if args.watch:
+        return
+
+    # the legacy invocation without a subcommand keeps showing the plots after ingestion
+    if args.legacy:
+        args.output_dir = None
+        args.headless = False
+        args.corr_threshold = 0.8
+        args.user_id = None
+        args.window_days = 0
+        run_report(args)
+
+if __name__ == "__main__":
+    main()